@@ -0,0 +1,178 @@
+"""
+Admission control: per-cost-class concurrency limits with bounded queues.
+
+Every request path maps to a cost class (settings.ADMISSION_CONTROL). A
+class runs at most CONCURRENCY requests at once and lets at most QUEUE more
+wait up to TIMEOUT seconds for a slot; anything beyond that is turned away
+immediately with 503 and Retry-After instead of tying up a worker. A single
+client may hold at most PER_CLIENT running-or-queued requests in a class
+and gets 429 past that. Classes are independent bulkheads, so LLM calls and
+cold analytics cannot starve cheap endpoints. A streaming response (e.g. an
+export) holds its slot until the stream is finished or closed.
+"""
+import functools
+import hashlib
+import threading
+from django.conf import settings
+from django.http import JsonResponse
+
+
+class CostClass:
+    """Concurrency limit, wait queue and per-client cap for one class of endpoints"""
+
+    def __init__(self, name, concurrency=None, queue=0, timeout=5.0, per_client=None, retry_after=1):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue = queue
+        self.timeout = timeout
+        self.per_client = per_client
+        self.retry_after = retry_after
+        self.running = 0
+        self.waiting = 0
+        self._clients = {}
+        self._condition = threading.Condition()
+
+    def acquire(self, client):
+        """Take a slot for client; returns None when admitted, else the rejection status"""
+        with self._condition:
+            if self.per_client is not None and self._clients.get(client, 0) >= self.per_client:
+                return 429
+            self._clients[client] = self._clients.get(client, 0) + 1
+            if self.concurrency is not None and self.running >= self.concurrency:
+                if self.waiting >= self.queue:
+                    self._release_client(client)
+                    return 503
+                self.waiting += 1
+                admitted = self._condition.wait_for(lambda: self.running < self.concurrency, self.timeout)
+                self.waiting -= 1
+                if not admitted:
+                    self._release_client(client)
+                    return 503
+            self.running += 1
+            return None
+
+    def release(self, client):
+        with self._condition:
+            self.running -= 1
+            self._release_client(client)
+            self._condition.notify()
+
+    def _release_client(self, client):
+        remaining = self._clients.get(client, 0) - 1
+        if remaining > 0:
+            self._clients[client] = remaining
+        else:
+            self._clients.pop(client, None)
+
+
+_cost_classes = None
+_cost_classes_lock = threading.Lock()
+
+
+def get_cost_classes():
+    """Process-wide cost classes and (path prefix, class) routes, longest prefix first"""
+    global _cost_classes
+    with _cost_classes_lock:
+        if _cost_classes is None:
+            config = getattr(settings, 'ADMISSION_CONTROL', {})
+            classes = {
+                name: CostClass(
+                    name,
+                    concurrency=options.get('CONCURRENCY'),
+                    queue=options.get('QUEUE', 0),
+                    timeout=options.get('TIMEOUT', 5.0),
+                    per_client=options.get('PER_CLIENT'),
+                    retry_after=options.get('RETRY_AFTER', 1),
+                )
+                for name, options in config.get('CLASSES', {}).items()
+            }
+            routes = sorted(config.get('ROUTES', {}).items(), key=lambda item: len(item[0]), reverse=True)
+            _cost_classes = (classes, routes, config.get('DEFAULT_CLASS'))
+        return _cost_classes
+
+
+def client_key(request):
+    """Identify the caller: auth token when present, otherwise the remote address"""
+    auth = request.META.get('HTTP_AUTHORIZATION')
+    if auth:
+        return "auth:" + hashlib.sha1(auth.encode()).hexdigest()[:16]
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR') if getattr(settings, 'ADMISSION_CONTROL', {}).get(
+        'TRUST_X_FORWARDED_FOR') else None
+    return "ip:" + (forwarded.split(',')[0].strip() if forwarded else request.META.get('REMOTE_ADDR', ''))
+
+
+class _HoldSlot:
+    """Streaming content that releases an admission slot once it is exhausted or closed"""
+
+    def __init__(self, content, release):
+        self.content = content
+        self._release = release
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            release, self._release = self._release, None
+        if release is not None:
+            release()
+
+
+class _SyncHoldSlot(_HoldSlot):
+    def __iter__(self):
+        try:
+            yield from self.content
+        finally:
+            self.close()
+
+
+class _AsyncHoldSlot(_HoldSlot):
+    # No __iter__: Django tells async content apart by iter() failing
+    async def __aiter__(self):
+        try:
+            async for part in self.content:
+                yield part
+        finally:
+            self.close()
+
+
+class AdmissionControlMiddleware:
+    """Reject requests fast when their cost class is saturated"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Shared by every handler in the process so limits are per worker process
+        self.classes, self.routes, self.default_class = get_cost_classes()
+        self.enabled = getattr(settings, 'ADMISSION_CONTROL', {}).get('ENABLED', True)
+
+    def classify(self, path):
+        for prefix, name in self.routes:
+            if path.startswith(prefix):
+                return self.classes.get(name)
+        return self.classes.get(self.default_class)
+
+    def __call__(self, request):
+        cost_class = self.classify(request.path) if self.enabled and request.method != 'OPTIONS' else None
+        if cost_class is None:
+            return self.get_response(request)
+
+        client = client_key(request)
+        rejected = cost_class.acquire(client)
+        if rejected:
+            if rejected == 429:
+                message = f"Too many concurrent {cost_class.name} requests from this client"
+            else:
+                message = f"Server busy with {cost_class.name} requests, please retry"
+            response = JsonResponse({"error": message}, status=rejected)
+            response['Retry-After'] = str(cost_class.retry_after)
+            return response
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            cost_class.release(client)
+            raise
+        if response.streaming:
+            # The body is produced after this returns; closing the response releases the slot
+            hold = _AsyncHoldSlot if response.is_async else _SyncHoldSlot
+            response.streaming_content = hold(response.streaming_content, functools.partial(cost_class.release, client))
+        else:
+            cost_class.release(client)
+        return response
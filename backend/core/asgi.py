@@ -14,3 +14,10 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
 
 application = get_asgi_application()
+
+# Heavy libraries are imported lazily; prefork servers can load them once here
+# so every worker starts warm and shares the pages
+from django.conf import settings
+from core.lazy import preload
+
+preload(getattr(settings, 'PRELOAD_MODULES', ()))
@@ -0,0 +1,97 @@
+"""
+Token authentication without a database query per request.
+
+Dashboards fan out many API calls per page, and with the stock
+TokenAuthentication each one looks its token up in SQLite. Here the
+(user, token) pair of a valid key is kept in memory for TTL seconds.
+Deleting or re-saving a token, or saving its user (deactivation, password
+change), drops the cached entries in this process straight away; other
+worker processes pick the change up when their entry expires, so TTL is
+the longest a revoked token keeps working there. Unknown keys are not
+cached, so a newly created token works immediately.
+"""
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+
+def _setting(name, default):
+    return getattr(settings, 'TOKEN_CACHE', {}).get(name, default)
+
+
+class TokenCache:
+    """Thread-safe LRU of token key -> (user, token) entries that expire after ttl seconds"""
+
+    def __init__(self, ttl=60.0, max_entries=10_000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires, user, token)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1], entry[2]
+
+    def put(self, key, user, token):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, user, token)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def discard_user(self, user_pk):
+        with self._lock:
+            for key in [key for key, (_, user, _) in self._entries.items() if user.pk == user_pk]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache(_setting('TTL', 60.0), _setting('MAX_ENTRIES', 10_000))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication that answers repeated keys from token_cache"""
+
+    def authenticate_credentials(self, key):
+        if not _setting('ENABLED', True):
+            return super().authenticate_credentials(key)
+        cached = token_cache.get(key)
+        if cached is not None:
+            return cached
+        # Raises AuthenticationFailed for unknown keys and inactive users
+        user, token = super().authenticate_credentials(key)
+        token_cache.put(key, user, token)
+        return user, token
+
+
+def _token_changed(sender, instance, **kwargs):
+    token_cache.discard(instance.key)
+
+
+def _user_changed(sender, instance, **kwargs):
+    token_cache.discard_user(instance.pk)
+
+
+post_save.connect(_token_changed, sender=Token, dispatch_uid='token_cache_token_saved')
+post_delete.connect(_token_changed, sender=Token, dispatch_uid='token_cache_token_deleted')
+post_save.connect(_user_changed, sender=get_user_model(), dispatch_uid='token_cache_user_saved')
+post_delete.connect(_user_changed, sender=get_user_model(), dispatch_uid='token_cache_user_deleted')
@@ -0,0 +1,88 @@
+"""
+Versioned in-process cache for computed analytics.
+
+Results are keyed by the data version of the files they were computed from,
+so a refreshed export is picked up automatically and stale entries simply
+age out of the LRU. Results that were slow to compute are also written to
+the on-disk cache (core/diskcache.py), so a restarted worker reads them
+back instead of recomputing them. Entries are kept per tenant, each tenant
+within its own byte quota (core/tenants.py).
+"""
+import hashlib
+import os
+import threading
+import time
+from django.conf import settings
+from core.diskcache import disk_cache, code_version
+from core.tenants import TenantLRU, estimate_size
+from core.utils import dataset_files
+
+
+def file_signature(path):
+    """Cheap identity of a file on disk: path, modification time and size"""
+    st = os.stat(path)
+    return (path, st.st_mtime_ns, st.st_size)
+
+
+def data_version(folder: str, stems):
+    """Short token that changes whenever any of the given data files changes"""
+    digest = hashlib.sha1(folder.encode())
+    for stem in sorted(stems):
+        paths = dataset_files(folder, stem)
+        digest.update(stem.encode())
+        digest.update(repr([file_signature(path) for path in paths]).encode() if paths else b"missing")
+    return digest.hexdigest()[:12]
+
+
+_MISSING = object()
+
+
+class VersionedCache:
+    """Thread-safe per-tenant LRU of computed results keyed by (name, data version, key).
+
+    namespace names the tenant quota (TENANTS["QUOTAS"]) the entries count against.
+    """
+
+    def __init__(self, max_entries: int = 256, disk=None, min_persist_seconds: float = 0.05,
+                 namespace: str = 'analytics'):
+        self.max_entries = max_entries
+        self.disk = disk
+        self.min_persist_seconds = min_persist_seconds
+        self._entries = TenantLRU(namespace, max_entries)
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, name: str, version: str, compute, key=()):
+        cache_key = (name, version, key)
+        with self._lock:
+            value = self._entries.get(cache_key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        found = False
+        if self.disk is not None:
+            code = code_version(compute)
+            found, value, _ = self.disk.load(name, key, version, code)
+        if not found:
+            start = time.perf_counter()
+            value = compute()
+            # Only results worth more than a disk read are persisted
+            if self.disk is not None and time.perf_counter() - start >= self.min_persist_seconds:
+                self.disk.store(name, key, version, value, code)
+
+        size = estimate_size(value)
+        with self._lock:
+            self._entries.put(cache_key, value, size)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_min_persist_seconds = getattr(settings, 'DISK_CACHE', {}).get('MIN_COMPUTE_SECONDS', 0.05)
+analytics_cache = VersionedCache(
+    getattr(settings, 'ANALYTICS_CACHE_MAX_ENTRIES', 256), disk_cache('analytics'), _min_persist_seconds, 'analytics'
+)
+partition_cache = VersionedCache(
+    getattr(settings, 'PARTITION_CACHE_MAX_ENTRIES', 128), disk_cache('partitions'), _min_persist_seconds, 'partitions'
+)
@@ -0,0 +1,59 @@
+"""
+Brotli compression for large payloads.
+
+gzip is handled by Django's GZipMiddleware. BrotliMiddleware sits inside it
+and compresses responses of at least MIN_BYTES with brotli when the client
+accepts it and the optional brotli package is installed; GZipMiddleware
+then leaves them alone, and compresses everything else with gzip. Streaming
+responses are skipped here; finance/export.py compresses its own.
+"""
+import re
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # Optional; GZipMiddleware covers clients without it
+    brotli = None
+
+ACCEPTS = re.compile(r'(?:^|,)\s*([\w*-]+)\s*(?:;\s*q=([\d.]+))?')
+
+
+def _setting(name, default):
+    return getattr(settings, 'RESPONSE_COMPRESSION', {}).get(name, default)
+
+
+def accepted_encodings(header):
+    """Encodings in an Accept-Encoding header with a non-zero quality"""
+    return {name.lower() for name, q in ACCEPTS.findall(header or '') if not q or float(q) > 0}
+
+
+class BrotliMiddleware:
+    """Compress responses above a size threshold with brotli, when available and accepted"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = _setting('ENABLED', True) and brotli is not None
+        self.min_bytes = _setting('MIN_BYTES', 1024)
+        self.brotli_quality = _setting('BROTLI_QUALITY', 5)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not self.enabled or response.streaming or response.has_header('Content-Encoding'):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if len(response.content) < self.min_bytes:
+            return response
+        if 'br' not in accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING')):
+            return response
+        content = brotli.compress(response.content, quality=self.brotli_quality)
+        if len(content) >= len(response.content):
+            return response
+
+        response.content = content
+        response['Content-Length'] = str(len(content))
+        response['Content-Encoding'] = 'br'
+        if response.has_header('ETag'):
+            # The compressed body is a different representation of the resource
+            response['ETag'] = re.sub(r'"$', '-br"', response['ETag'])
+        return response
@@ -0,0 +1,106 @@
+"""
+Delta responses for time-series panels.
+
+A client that already holds a series passes the data version it got
+(``?since_version=``) and receives only the buckets that changed or were
+added since then, plus the ones that disappeared, instead of the whole
+multi-year series. The series served for each panel request is remembered
+for its last few data versions; when the requested base version is no
+longer known the whole series comes back in the same envelope with
+``full`` set. Snapshots are kept per tenant (core/tenants.py).
+"""
+import threading
+from collections import OrderedDict
+from core.renderers import is_frame, frame_records
+from core.tenants import TenantLRU, estimate_size
+
+
+class RowDelta:
+    """Series given as a list of row dicts (or a frame), diffed by row position"""
+
+    def snapshot(self, data):
+        rows = frame_records(data) if is_frame(data) else data
+        if not isinstance(rows, list):
+            return None
+        return OrderedDict(enumerate(rows))
+
+    def payload(self, data, snapshot, changed, removed):
+        return {
+            "length": len(snapshot),
+            "changed": [{"index": index, "row": snapshot[index]} for index in changed],
+        }
+
+
+class LabelDelta:
+    """Series given as parallel labels/values arrays in a dict, diffed by label"""
+
+    def __init__(self, labels='labels', values='values'):
+        self.labels = labels
+        self.values = values
+
+    def snapshot(self, data):
+        if not isinstance(data, dict) or self.labels not in data or self.values not in data:
+            return None
+        return OrderedDict(zip(data[self.labels], data[self.values]))
+
+    def payload(self, data, snapshot, changed, removed):
+        rest = {key: value for key, value in data.items() if key not in (self.labels, self.values)}
+        return {
+            **rest,
+            self.labels: list(changed),
+            self.values: [snapshot[label] for label in changed],
+            "removed": list(removed),
+        }
+
+
+class DeltaHistory:
+    """Series snapshots of the last few data versions per panel request, per tenant"""
+
+    def __init__(self, max_entries=512, versions=4):
+        self.max_entries = max_entries
+        self.versions = versions
+        self._entries = TenantLRU('deltas', max_entries)  # key -> OrderedDict(version -> (snapshot, size))
+        self._lock = threading.Lock()
+
+    def record(self, key, version, snapshot):
+        size = estimate_size(snapshot)
+        with self._lock:
+            history = self._entries.get(key)
+            if history is None:
+                history = OrderedDict()
+            history[version] = (snapshot, size)
+            history.move_to_end(version)
+            while len(history) > self.versions:
+                history.popitem(last=False)
+            self._entries.put(key, history, sum(entry[1] for entry in history.values()))
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key, {}).get(version)
+        return entry[0] if entry is not None else None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def diff(base, snapshot):
+    """(changed or added bucket keys, removed bucket keys) going from base to snapshot"""
+    changed = [key for key, value in snapshot.items() if key not in base or base[key] != value]
+    removed = [key for key in base if key not in snapshot]
+    return changed, removed
+
+
+def delta_response_data(delta, data, snapshot, base, version, since_version, stale):
+    """Envelope with the buckets changed since since_version, or all of them when base is unknown"""
+    if base is None:
+        changed, removed = list(snapshot), []
+    else:
+        changed, removed = diff(base, snapshot)
+    return {
+        "data_version": version,
+        "since_version": since_version,
+        "full": base is None,
+        "stale": stale,
+        **delta.payload(data, snapshot, changed, removed),
+    }
@@ -0,0 +1,318 @@
+"""
+On-disk persistence for computed results, so they survive restarts and deploys.
+
+Entries are pickled under DIRECTORY/<namespace>/<tenant>/<name>/<key hash>/
+in a file named after (hashes of) the data version and the code version of the
+computation, so an edited computation is recomputed instead of being read
+back stale. The code version hashes the source of the module defining the
+compute function and of every project module it imports, directly or not
+(imports inside functions included). Each file also records the version of
+the module of every class in the pickled value (project modules hashed the
+same way, libraries by their installed version); an entry whose classes
+changed since it was written, e.g. after a pandas upgrade, is dropped on
+read. CODE_VERSION is only a manual override for changes outside the
+project's source, such as data files the code reads.
+Writing a new version of an entry deletes its other versions, and each
+tenant's directory is kept under its "disk" quota (core/tenants.py,
+MAX_BYTES by default) by deleting its least recently used files. Files are written atomically, so worker processes can share the
+directory.
+
+Reading an entry unpickles it, which runs whatever the file says, so the
+directory must be private to the server's user. It is created with mode
+0700, and a directory owned by another user, writable by group or others,
+or replaced by a symlink is refused: persistence is then off for that
+namespace and everything is computed in memory.
+
+A cold worker reads entries back lazily on first use rather than at
+startup, which keeps startup fast and only loads what is asked for.
+"""
+import ast
+import hashlib
+import importlib.metadata
+import importlib.util
+import io
+import logging
+import os
+import pickle
+import shutil
+import stat
+import sys
+import threading
+from django.conf import settings
+from core.tenants import current_tenant, quota
+
+logger = logging.getLogger(__name__)
+
+_code_versions = {}  # module -> version of its code, see _module_version
+_distributions = None  # top-level module -> installed distributions providing it
+
+
+def _setting(name, default):
+    return getattr(settings, 'DISK_CACHE', {}).get(name, default)
+
+
+def _project_file(module_name):
+    """Source file of a module of this project (under BASE_DIR), or None for anything else"""
+    parts = module_name.split('.')
+    base = os.path.join(str(settings.BASE_DIR), *parts)
+    for path in (base + '.py', os.path.join(base, '__init__.py')):
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def _imports(path, module_name):
+    """Names of the modules a source file imports, anywhere in it (lazy imports included)"""
+    with open(path, 'rb') as f:
+        tree = ast.parse(f.read(), path)
+    package = module_name if path.endswith('__init__.py') else module_name.rpartition('.')[0]
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            yield from (alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            base = importlib.util.resolve_name('.' * node.level + (node.module or ''), package) \
+                if node.level else node.module
+            yield base
+            # "from package import module" names a module too
+            yield from (f"{base}.{alias.name}" for alias in node.names)
+
+
+def _library_version(top):
+    global _distributions
+    if _distributions is None:
+        _distributions = importlib.metadata.packages_distributions()
+    try:
+        return ','.join(f"{name}=={importlib.metadata.version(name)}" for name in _distributions.get(top, ()))
+    except importlib.metadata.PackageNotFoundError:
+        return ''
+
+
+def _module_version(module_name):
+    """Version of the code behind a module.
+
+    For modules of this project: a hash of its source and of every project
+    module it imports, directly or not. For libraries: the installed version
+    of the top-level package (the interpreter's for the standard library).
+    """
+    if module_name in _code_versions:
+        return _code_versions[module_name]
+    top = module_name.partition('.')[0]
+    if _project_file(module_name) is None:
+        if top in sys.stdlib_module_names or top == 'builtins':
+            version = sys.version.split()[0]
+        else:
+            # From the installed metadata: a module being imported by another thread has no __version__ yet
+            version = _library_version(top)
+    else:
+        digest = hashlib.sha1(str(_setting('CODE_VERSION', '')).encode())
+        seen, pending = set(), [module_name]
+        while pending:
+            name = pending.pop()
+            path = _project_file(name) if name not in seen else None
+            seen.add(name)
+            if path is None:
+                continue
+            try:
+                with open(path, 'rb') as f:
+                    source = f.read()
+                pending.extend(_imports(path, name))
+            except (OSError, SyntaxError, ImportError):
+                source = path.encode()
+            digest.update(name.encode() + b'\0' + source)
+        version = digest.hexdigest()[:10]
+    _code_versions[module_name] = version
+    return version
+
+
+def code_version(fn):
+    """Version of the code behind a compute callable: its module and the project modules that reaches"""
+    fn = getattr(fn, 'func', fn)  # functools.partial
+    module_name = getattr(fn, '__module__', None)
+    if not module_name or module_name == '__main__':
+        code = getattr(fn, '__code__', None)
+        return _hash(code.co_filename if code is not None else repr(fn), 10)
+    return _module_version(module_name)
+
+
+class _RecordingPickler(pickle.Pickler):
+    """Pickler that notes the module of every class it writes an instance of"""
+
+    def __init__(self, file):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.modules = set()
+
+    def reducer_override(self, obj):
+        cls = obj if isinstance(obj, type) else type(obj)
+        self.modules.add(getattr(cls, '__module__', None) or 'builtins')
+        return NotImplemented
+
+
+def _hash(value, length=20):
+    return hashlib.sha1(repr(value).encode()).hexdigest()[:length]
+
+
+def _private_directory(path):
+    """Create path with mode 0700 if missing; True when only this process's user can write to it"""
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        st = os.lstat(path)
+    except OSError:
+        logger.warning("Disk cache directory %s is not usable", path, exc_info=True)
+        return False
+    if not stat.S_ISDIR(st.st_mode):
+        logger.warning("Disk cache directory %s is not a directory; persistence is off", path)
+        return False
+    if hasattr(os, 'getuid') and st.st_uid != os.getuid():
+        logger.warning("Disk cache directory %s belongs to another user; persistence is off", path)
+        return False
+    if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        logger.warning("Disk cache directory %s is writable by group or others; persistence is off", path)
+        return False
+    return True
+
+
+class DiskCache:
+    """Pickled (name, key) -> value entries of one namespace, one current version each, per tenant"""
+
+    def __init__(self, directory, max_bytes, root=None):
+        self.directory = str(directory)
+        self.root = str(root) if root is not None else None  # Shared parent that must be private too
+        self.max_bytes = max_bytes
+        self._sizes = {}  # tenant -> bytes on disk, measured on its first write
+        self._lock = threading.Lock()
+        self._private = None  # Whether the directory passed _private_directory, checked on first use
+
+    def _usable(self):
+        if self._private is None:
+            with self._lock:
+                if self._private is None:
+                    self._private = (self.root is None or _private_directory(self.root)) \
+                        and _private_directory(self.directory)
+        return self._private
+
+    def _tenant_dir(self, tenant):
+        return os.path.join(self.directory, tenant)
+
+    def _entry_dir(self, name, key):
+        return os.path.join(self._tenant_dir(current_tenant()), name, _hash((name, key)))
+
+    def load(self, name, key, version=None, code=''):
+        """(True, value, version) for a stored entry, else (False, None, None).
+
+        With version None the entry is returned whatever its data version
+        (the caller decides whether it is current); the code version must
+        always match.
+        """
+        if not self._usable():
+            return False, None, None
+        entry_dir = self._entry_dir(name, key)
+        try:
+            files = os.listdir(entry_dir)
+        except OSError:
+            return False, None, None
+        wanted = f"{_hash(version, 16)}-{code}.pkl" if version is not None else None
+        for filename in files:
+            if not filename.endswith(f"-{code}.pkl") or (wanted is not None and filename != wanted):
+                continue
+            path = os.path.join(entry_dir, filename)
+            try:
+                with open(path, 'rb') as f:
+                    stored_version, modules = pickle.load(f)
+                    # Written by other code than is running now, e.g. before a library upgrade
+                    if any(_module_version(module) != written for module, written in modules.items()):
+                        self._remove(path)
+                        continue
+                    value = pickle.load(f)
+                os.utime(path)  # Recently used
+                return True, value, stored_version
+            except Exception:
+                logger.warning("Dropping unreadable cache file %s", path, exc_info=True)
+                self._remove(path)
+        return False, None, None
+
+    def store(self, name, key, version, value, code=''):
+        """Persist value as the current version of (name, key), replacing older versions"""
+        if not self._usable():
+            return False
+        entry_dir = self._entry_dir(name, key)
+        path = os.path.join(entry_dir, f"{_hash(version, 16)}-{code}.pkl")
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(entry_dir, mode=0o700, exist_ok=True)
+            buffer = io.BytesIO()
+            pickler = _RecordingPickler(buffer)
+            pickler.dump(value)
+            modules = {module: _module_version(module) for module in pickler.modules}
+            with open(tmp, 'wb') as f:
+                pickle.dump((version, modules), f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.write(buffer.getbuffer())
+            size = os.path.getsize(tmp)
+            os.replace(tmp, path)
+        except Exception:
+            # Unpicklable values or a full disk only cost the persistence
+            logger.warning("Could not persist cache entry %s", name, exc_info=True)
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return False
+        for filename in os.listdir(entry_dir):
+            if filename != os.path.basename(path) and not filename.endswith('.tmp'):
+                self._remove(os.path.join(entry_dir, filename))
+        self._grow(current_tenant(), size)
+        return True
+
+    def _remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        tenant = current_tenant()
+        with self._lock:
+            if tenant in self._sizes:
+                self._sizes[tenant] -= size
+
+    def _files(self, tenant):
+        for root, _, files in os.walk(self._tenant_dir(tenant)):
+            for filename in files:
+                if filename.endswith('.pkl'):
+                    path = os.path.join(root, filename)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    yield st.st_mtime, st.st_size, path
+
+    def _grow(self, tenant, size):
+        max_bytes = quota(tenant, 'disk', self.max_bytes)
+        with self._lock:
+            if tenant not in self._sizes:
+                self._sizes[tenant] = sum(file_size for _, file_size, _ in self._files(tenant))
+            else:
+                self._sizes[tenant] += size
+            if self._sizes[tenant] <= max_bytes:
+                return
+            # Evict the tenant's least recently used files down to 90% of its limit
+            files = sorted(self._files(tenant))
+            self._sizes[tenant] = sum(file_size for _, file_size, _ in files)
+            for _, file_size, path in files:
+                if self._sizes[tenant] <= max_bytes * 0.9:
+                    break
+                try:
+                    os.remove(path)
+                    self._sizes[tenant] -= file_size
+                except OSError:
+                    pass
+
+    def clear(self):
+        with self._lock:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self._sizes.clear()
+            self._private = None
+
+
+def disk_cache(namespace):
+    """DiskCache for a namespace under settings.DISK_CACHE, or None when persistence is off"""
+    if not _setting('ENABLED', False):
+        return None
+    root = str(_setting('DIRECTORY', 'cache'))
+    return DiskCache(os.path.join(root, namespace), _setting('MAX_BYTES', 2 * 1024 ** 3), root=root)
@@ -0,0 +1,37 @@
+"""
+Deferred imports for heavy libraries.
+
+pandas and numpy take most of the project's import time, but management
+commands, URL resolution and many requests never touch them. Modules bind
+them with ``pd = lazy_import('pandas')`` and the real import happens on
+first attribute access. Servers that fork workers can import them up front
+with ``preload()`` so every worker shares the loaded pages.
+"""
+import importlib
+import sys
+import types
+
+
+class LazyModule(types.ModuleType):
+    """Module proxy that imports the real module on first attribute access"""
+
+    def __getattr__(self, attr):
+        # Only reached for attributes not yet copied over, i.e. before the first load
+        # or for submodules imported later; import_module is safe across threads
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+    def __dir__(self):
+        return dir(importlib.import_module(self.__name__))
+
+
+def lazy_import(name):
+    """The module if it is already imported, otherwise a proxy that imports it on first use"""
+    return sys.modules.get(name) or LazyModule(name)
+
+
+def preload(names):
+    """Import the given modules now, e.g. before a prefork server starts its workers"""
+    for name in names:
+        importlib.import_module(name)
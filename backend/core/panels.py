@@ -0,0 +1,207 @@
+"""
+Stale-while-revalidate cache for dashboard panel responses.
+
+A panel's last good response is kept per (panel, query string) together with
+the data version it was computed from. When the data changes, the next
+request gets that previous response straight away, marked ``stale`` with
+its data version, while the panel is recomputed once in the background.
+Requests with nothing to fall back on wait for the computation up to the
+panel's deadline and then get a 503 with Retry-After; the computation keeps
+running so a retry finds it finished.
+
+Dict payloads carry ``stale`` and ``data_version`` keys; list payloads get
+the same information as X-Stale / X-Data-Version headers.
+
+Last good responses are also written to the on-disk cache
+(core/diskcache.py), so after a restart or deploy the first request of a
+panel is served from disk (as stale, if the data changed meanwhile)
+instead of waiting for a computation.
+
+Responses and delta snapshots are kept per tenant, within the tenant's
+"panels" and "deltas" byte quotas (core/tenants.py).
+"""
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from datetime import date
+from django.conf import settings
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from core.cache import data_version
+from core.diskcache import disk_cache, code_version
+from core.deltas import DeltaHistory, delta_response_data
+from core.tenants import TenantLRU, current_tenant, estimate_size, submit_in_context
+from core.utils import get_data_folder
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name, default):
+    return getattr(settings, 'PANEL_CACHE', {}).get(name, default)
+
+
+class PanelCache:
+    """Last good response per panel request plus the computations in flight"""
+
+    def __init__(self, max_entries=512, workers=4, disk=None):
+        self.max_entries = max_entries
+        self.workers = workers
+        self.disk = disk
+        self._entries = TenantLRU('panels', max_entries)  # key -> (version, data)
+        self._inflight = {}  # (tenant, key, version) -> Future
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='panel-refresh')
+        return self._executor
+
+    def _remember(self, key, version, data):
+        size = estimate_size(data)
+        with self._lock:
+            self._entries.put(key, (version, data), size)
+
+    def _compute(self, key, version, compute, code):
+        try:
+            response = compute()
+            if response.status_code == status.HTTP_200_OK:
+                self._remember(key, version, response.data)
+                if self.disk is not None:
+                    self.disk.store("panel", key, version, response.data, code)
+            return response
+        except Exception:
+            logger.exception("Panel computation failed for %s", key)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop((current_tenant(), key, version), None)
+
+    def _submit(self, key, version, compute, code):
+        """The running computation of key at version, starting it if needed"""
+        with self._lock:
+            future = self._inflight.get((current_tenant(), key, version))
+            if future is None:
+                # In a copy of the request's context, so the result lands in its tenant's cache
+                future = submit_in_context(self._pool(), self._compute, key, version, compute, code)
+                self._inflight[(current_tenant(), key, version)] = future
+            return future
+
+    def serve(self, key, version, compute, deadline, code=''):
+        """(response, version of its payload, stale) for a panel request.
+
+        code is the code version of the panel (core/diskcache.py); responses
+        on disk from other code are ignored.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None and self.disk is not None:
+            found, data, stored_version = self.disk.load("panel", key, code=code)
+            if found:
+                entry = (stored_version, data)
+                self._remember(key, stored_version, data)
+        if entry is not None and entry[0] == version:
+            return Response(entry[1], status=status.HTTP_200_OK), version, False
+
+        future = self._submit(key, version, compute, code)
+        if entry is not None:
+            return Response(entry[1], status=status.HTTP_200_OK), entry[0], True
+        try:
+            # Requests waiting on the same computation each get their own Response
+            result = future.result(timeout=deadline)
+            return Response(result.data, status=result.status_code), version, False
+        except TimeoutError:
+            response = Response(
+                {"error": "This panel is still being computed, please retry shortly"},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            )
+            response['Retry-After'] = str(max(int(deadline), 1))
+            return response, version, False
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+panel_cache = PanelCache(_setting('MAX_ENTRIES', 512), _setting('WORKERS', 4), disk_cache('panels'))
+delta_history = DeltaHistory(_setting('MAX_ENTRIES', 512), _setting('DELTA_VERSIONS', 4))
+
+
+def _mark(response, version, stale):
+    if response.status_code != status.HTTP_200_OK:
+        return response
+    if isinstance(response.data, dict):
+        response.data = {**response.data, "stale": stale, "data_version": version}
+    else:
+        response['X-Data-Version'] = version
+        response['X-Stale'] = 'true' if stale else 'false'
+    return response
+
+
+# Panel name -> data stems it is computed from, filled in by cached_panel
+PANELS = {}
+
+
+def panel_versions(data_folder, names=None):
+    """Current data version of every registered panel (or of the named ones)"""
+    return {
+        name: data_version(data_folder, stems)
+        for name, stems in PANELS.items() if names is None or name in names
+    }
+
+
+def _with_delta(delta, key, response, version, stale, since_version):
+    """Record the served series and, when asked, answer with what changed since since_version"""
+    if response.status_code != status.HTTP_200_OK:
+        return response
+    snapshot = delta_history.get(key, version)
+    if snapshot is None:
+        snapshot = delta.snapshot(response.data)
+        if snapshot is None:
+            return response  # Fallback payloads that are not a series
+        delta_history.record(key, version, snapshot)
+    if not since_version:
+        return response
+    base = delta_history.get(key, since_version)
+    return Response(
+        delta_response_data(delta, response.data, snapshot, base, version, since_version, stale),
+        status=status.HTTP_200_OK,
+    )
+
+
+def cached_panel(name, stems, delta=None):
+    """Serve an APIView.get through the panel cache, keyed on the query string and data version of stems.
+
+    With a delta (core/deltas.py) the panel also answers ?since_version=
+    with only the buckets that changed since that version.
+    """
+    PANELS[name] = tuple(stems)
+
+    def decorate(get):
+        @functools.wraps(get)
+        def wrapper(view, request, *args, **kwargs):
+            if not _setting('ENABLED', True) and delta is None:
+                return get(view, request, *args, **kwargs)
+            data_folder = get_data_folder()
+            version = data_version(data_folder, stems)
+            # These only change how the result is sent, so they share one entry
+            params = tuple(sorted(
+                (k, tuple(v)) for k, v in request.GET.lists()
+                if k not in (api_settings.URL_FORMAT_OVERRIDE, 'since_version')
+            ))
+            # Today's date is part of the key because panels age invoices against it
+            key = (name, data_folder, params, date.today().isoformat())
+            if _setting('ENABLED', True):
+                deadline = _setting('DEADLINES', {}).get(name, _setting('DEADLINE', 10.0))
+                response, served_version, stale = panel_cache.serve(
+                    key, version, lambda: get(view, request, *args, **kwargs), deadline, code_version(get)
+                )
+            else:
+                response, served_version, stale = get(view, request, *args, **kwargs), version, False
+            if delta is not None:
+                response = _with_delta(delta, key, response, served_version, stale, request.GET.get('since_version'))
+            return _mark(response, served_version, stale)
+        return wrapper
+    return decorate
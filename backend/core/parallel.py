@@ -0,0 +1,201 @@
+"""
+Parallel filter + aggregate over the partitions of a dataset.
+
+Each partition is reduced to mergeable partial results (sums, counts,
+min/max, distinct-count and quantile sketches from core/sketches.py, the
+top rows by a column) in a worker process, and the partials are merged in
+the calling process. Distinct counts and quantiles are therefore
+approximate, with the sketches' error bounds. Small inputs skip the pool
+entirely.
+"""
+import functools
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from core.lazy import lazy_import
+from django.conf import settings
+from core.utils import find_partitions, find_path, _read_partition, _select_partitions
+from core.sketches import HyperLogLog, QuantileSketch, sketch_cells
+from core.tenants import current_tenant, run_in_tenant
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+
+def _union(sketch_class):
+    return lambda sketches: sketch_class.union(list(sketches))
+
+
+# agg -> (partial aggregations per partition, how partials merge)
+PARTIALS = {
+    "sum": (("sum",), {"sum": "sum"}),
+    "count": (("count",), {"count": "sum"}),
+    "min": (("min",), {"min": "min"}),
+    "max": (("max",), {"max": "max"}),
+    "mean": (("sum", "count"), {"sum": "sum", "count": "sum"}),
+    "distinct": (("sketch",), {"sketch": _union(HyperLogLog)}),
+    "quantile": (("sketch",), {"sketch": _union(QuantileSketch)}),
+}
+
+
+def _measure(spec):
+    """(column, agg, q) of a measure given as (column, agg) or (column, "quantile", q)"""
+    column, agg, *rest = spec
+    return column, agg, (rest[0] if rest else 0.5)
+
+
+def _sketches(df, grouped, column, agg):
+    """One sketch of column per group (in group order), or a single one without groups"""
+    if grouped is None:
+        return sketch_cells(df[column].to_numpy(), np.zeros(len(df), dtype=np.int64), 1, agg)[0]
+    cells = grouped.ngroup().to_numpy()
+    kept = cells >= 0  # Rows with a missing group key belong to no group
+    sketches = sketch_cells(df[column].to_numpy()[kept], cells[kept], grouped.ngroups, agg)
+    return pd.Series(sketches, index=grouped.size().index)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _setting(name, default):
+    return getattr(settings, 'PARALLEL_AGGREGATION', {}).get(name, default)
+
+
+def _init_worker():
+    """Spawned workers start without Django; filter functions may need the app registry"""
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+def get_executor():
+    """Shared process pool, created on first parallel aggregation"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            context = multiprocessing.get_context(_setting('START_METHOD', 'spawn'))
+            _executor = ProcessPoolExecutor(
+                max_workers=_setting('WORKERS', None) or os.cpu_count(),
+                mp_context=context,
+                initializer=_init_worker,
+            )
+        return _executor
+
+
+def aggregate_partition(path, measures, group_by=(), filter_fn=None, filter_kwargs=None, top_rows=None, empty=False):
+    """Partial aggregates of one partition file.
+
+    Returns (partials, top, present) where partials has one column per
+    measure part (``<name>__<part>``) and present lists the measures whose
+    column exists in this partition.
+    """
+    df = _read_partition(path)
+    if empty:
+        df = df.iloc[0:0]  # Schema only: every partition was pruned
+    if filter_fn is not None:
+        df = filter_fn(df, **(filter_kwargs or {}))
+
+    present = [name for name, spec in measures.items() if spec[0] is None or spec[0] in df.columns]
+    parts = {}
+    grouped = df.groupby(list(group_by), observed=True, sort=False) if group_by else None
+    for name in present:
+        column, agg, _ = _measure(measures[name])
+        for part in PARTIALS[agg][0]:
+            if part == "sketch":
+                parts[f"{name}__{part}"] = _sketches(df, grouped, column, agg)
+            elif column is None:
+                parts[f"{name}__{part}"] = grouped.size() if grouped is not None else len(df)
+            else:
+                source = grouped[column] if grouped is not None else df[column]
+                parts[f"{name}__{part}"] = getattr(source, part)()
+    partials = pd.DataFrame(parts).reset_index() if grouped is not None else pd.DataFrame([parts])
+
+    top = None
+    if top_rows is not None and top_rows[0] in df.columns:
+        top = df.nlargest(top_rows[1], top_rows[0])
+    return partials, top, present
+
+
+def _merge(results, measures, group_by, top_rows):
+    present = set()
+    for _, _, names in results:
+        present.update(names)
+    partials = pd.concat([partial for partial, _, _ in results], ignore_index=True)
+
+    merge_how = {}
+    for name in present:
+        agg = _measure(measures[name])[1]
+        for part, how in PARTIALS[agg][1].items():
+            merge_how[f"{name}__{part}"] = how
+    if group_by:
+        merged = partials.groupby(list(group_by), observed=True).agg(merge_how).reset_index() if merge_how else \
+            partials[list(group_by)].drop_duplicates()
+    else:
+        merged = pd.DataFrame([{
+            col: how(partials[col]) if callable(how) else getattr(partials[col], how)()
+            for col, how in merge_how.items()
+        }])
+
+    result = merged[list(group_by)].copy() if group_by else pd.DataFrame(index=merged.index)
+    for name, spec in measures.items():
+        _, agg, q = _measure(spec)
+        if name not in present:
+            result[name] = None
+        elif agg == "mean":
+            result[name] = merged[f"{name}__sum"] / merged[f"{name}__count"].where(merged[f"{name}__count"] != 0)
+        elif agg == "distinct":
+            result[name] = [sketch.count() for sketch in merged[f"{name}__sketch"]]
+        elif agg == "quantile":
+            result[name] = [sketch.quantile(q) for sketch in merged[f"{name}__sketch"]]
+        else:
+            result[name] = merged[f"{name}__{agg}"]
+
+    top = None
+    tops = [t for _, t, _ in results if t is not None]
+    if tops:
+        top = pd.concat(tops, ignore_index=True).nlargest(top_rows[1], top_rows[0])
+    return result, top
+
+
+def aggregate_partitions(folder, stem, measures, group_by=(), filter_fn=None, filter_kwargs=None,
+                         date_start=None, date_end=None, top_rows=None):
+    """Filter and aggregate a dataset partition by partition, in parallel when worthwhile.
+
+    measures maps an output name to (column, agg) with agg one of sum, count,
+    min, max, mean or distinct, or to (column, "quantile", q); a None column
+    counts rows. Distinct counts and quantiles come from merged sketches. top_rows=(column, n) also
+    returns the n largest rows by column. Returns None if the dataset is
+    missing, else a dict with the aggregated frame (a single row without
+    group_by), the top rows and how the work was executed.
+    """
+    partitions = find_partitions(folder, stem)
+    if partitions:
+        paths = _select_partitions(partitions, date_start, date_end)
+    else:
+        path = find_path(folder, stem)
+        if not path:
+            return None
+        paths = [path]
+
+    args = (measures, tuple(group_by), filter_fn, filter_kwargs, top_rows)
+    if not paths:
+        result, top = _merge([aggregate_partition(partitions[0][0], *args, empty=True)], measures, group_by, top_rows)
+        return {"result": result, "top_rows": top, "partitions": 0, "parallel": False}
+    total_bytes = sum(os.path.getsize(path) for path in paths)
+    parallel = (
+        len(paths) > 1
+        and total_bytes >= _setting('MIN_BYTES', 64 * 1024 * 1024)
+        and (_setting('WORKERS', None) or os.cpu_count() or 1) > 1
+    )
+    if parallel:
+        executor = get_executor()
+        # Workers cache partitions too; they do so under the caller's tenant
+        task = functools.partial(run_in_tenant, current_tenant(), aggregate_partition)
+        results = list(executor.map(task, paths, *[[arg] * len(paths) for arg in args]))
+    else:
+        results = [aggregate_partition(path, *args) for path in paths]
+
+    result, top = _merge(results, measures, group_by, top_rows)
+    return {"result": result, "top_rows": top, "partitions": len(paths), "parallel": parallel}
@@ -0,0 +1,529 @@
+"""
+Declarative aggregation queries over the data folder.
+
+A query spec names a dataset stem, measures, group-by dimensions, filters,
+an optional time grain, sort and limit. The planner answers it from the
+cheapest available source:
+
+* ``cube``  - a monthly pre-aggregate over the dimensions the query groups
+  and filters by, when those are all low-cardinality columns and date
+  filters fall on month boundaries (one cube per dimension set);
+* ``index`` - the dataset with categorical dimensions, sorted by its time
+  column so date ranges are binary-searched instead of scanned;
+* ``raw``   - the frame as read, for small files where building an index
+  costs more than it saves.
+
+Besides additive measures the cube answers ``distinct`` and ``quantile``
+from mergeable sketches kept per month x dimension cell (core/sketches.py),
+so those are approximate on the cube path and exact elsewhere.
+
+Results are capped at QUERY_ENGINE["DEFAULT_LIMIT"] rows unless the spec
+asks for a limit, which may not exceed MAX_LIMIT; the plan reports the
+uncapped row count and whether rows were cut.
+
+Cubes, indexes and results are cached per data version.
+"""
+import hashlib
+import json
+import os
+import re
+from datetime import date
+from core.lazy import lazy_import
+from django.conf import settings
+from core.cache import analytics_cache, data_version
+from core.utils import read_table, dataset_files
+from core.sketches import HyperLogLog, QuantileSketch, sketch_cells
+from core.semantic import DERIVED, add_derived, is_dated
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+AGGREGATIONS = ('sum', 'count', 'mean', 'min', 'max', 'distinct', 'quantile')
+SKETCH_AGGREGATIONS = ('distinct', 'quantile')
+QUANTILE_SHORTHAND = re.compile(r'^p(\d{1,2})$')  # "p90:lead_time_days"
+FILTER_OPS = ('eq', 'ne', 'in', 'not_in', 'gt', 'gte', 'lt', 'lte', 'between')
+RANGE_OPS = ('gt', 'gte', 'lt', 'lte', 'between')
+TIME_GRAINS = {'day': 'D', 'week': 'W', 'month': 'M', 'quarter': 'Q', 'year': 'Y'}
+CUBE_GRAINS = (None, 'month', 'quarter', 'year')
+DATASET_NAME = re.compile(r'^[A-Za-z0-9_]+$')
+MAX_DIMENSION_CARDINALITY = 200
+
+
+class QueryError(ValueError):
+    """Invalid query spec; reported to the client as a 400"""
+
+
+def _setting(name, default):
+    return getattr(settings, 'QUERY_ENGINE', {}).get(name, default)
+
+
+def with_derived_columns(df, dataset):
+    """Add the dataset's derived columns (core/semantic.py) whose sources are present"""
+    return add_derived(df, dataset)
+
+
+# ---------------------------------------------------------------------------
+# Spec parsing
+# ---------------------------------------------------------------------------
+
+def _list(spec, name):
+    value = spec.get(name) or []
+    if not isinstance(value, list):
+        raise QueryError(f"{name} must be a list")
+    return value
+
+
+def parse_spec(spec):
+    """Validate a query spec and return it in canonical form"""
+    if not isinstance(spec, dict):
+        raise QueryError("Query spec must be a JSON object")
+    dataset = spec.get('dataset')
+    if not isinstance(dataset, str) or not DATASET_NAME.match(dataset):
+        raise QueryError("dataset must be a data file stem such as 'sales_flat'")
+
+    measures = []
+    for measure in _list(spec, 'measures') or [{"agg": "count"}]:
+        if isinstance(measure, str):  # "sum:extended_price" shorthand
+            agg, _, column = measure.partition(':')
+            measure = {"agg": agg, "column": column or None}
+            percentile = QUANTILE_SHORTHAND.match(agg)
+            if percentile:
+                measure = {"agg": "quantile", "q": int(percentile.group(1)) / 100, "column": column or None,
+                           "as": f"{agg}_{column}"}
+        if not isinstance(measure, dict):
+            raise QueryError(f"Invalid measure: {measure}")
+        agg = measure.get('agg', 'sum')
+        column = measure.get('column')
+        if column is not None and not isinstance(column, str):
+            raise QueryError(f"Measure column must be a column name, not {column}")
+        if agg not in AGGREGATIONS:
+            raise QueryError(f"Unsupported aggregation '{agg}'")
+        if agg != 'count' and not column:
+            raise QueryError(f"Aggregation '{agg}' needs a column")
+        name = measure.get('as') or (f"{agg}_{column}" if column else agg)
+        parsed = {"agg": agg, "column": column, "as": name}
+        if agg == 'quantile':
+            q = measure.get('q', 0.5)
+            if not isinstance(q, (int, float)) or not 0 <= q <= 1:
+                raise QueryError("Quantile 'q' must be between 0 and 1")
+            parsed["q"] = float(q)
+        measures.append(parsed)
+
+    filters = []
+    raw_filters = spec.get('filters') or []
+    if isinstance(raw_filters, dict):  # {"country": ["UAE"], "status": "Delivered"}
+        raw_filters = [
+            {"column": col, "op": "in" if isinstance(value, list) else "eq", "value": value}
+            for col, value in raw_filters.items()
+        ]
+    elif not isinstance(raw_filters, list):
+        raise QueryError("filters must be a list or an object")
+    for item in raw_filters:
+        if not isinstance(item, dict):
+            raise QueryError(f"Invalid filter: {item}")
+        op = item.get('op', 'eq')
+        if op not in FILTER_OPS or not isinstance(item.get('column'), str) or not item['column']:
+            raise QueryError(f"Invalid filter: {item}")
+        if op in ('in', 'not_in', 'between') and not isinstance(item.get('value'), list):
+            raise QueryError(f"Filter op '{op}' needs a list value")
+        if op == 'between' and len(item['value']) != 2:
+            raise QueryError("Filter op 'between' needs exactly two values")
+        filters.append({"column": item['column'], "op": op, "value": item.get('value')})
+
+    time_grain = spec.get('time_grain')
+    if time_grain is not None and time_grain not in TIME_GRAINS:
+        raise QueryError(f"time_grain must be one of {', '.join(TIME_GRAINS)}")
+
+    sort = []
+    for item in _list(spec, 'sort'):
+        if isinstance(item, str):
+            item = {"column": item.lstrip('-'), "desc": item.startswith('-')}
+        if not isinstance(item, dict) or not isinstance(item.get('column'), str) or not item['column']:
+            raise QueryError(f"Invalid sort: {item}")
+        sort.append({"column": item['column'], "desc": bool(item.get('desc', False))})
+
+    time_column = spec.get('time_column')
+    if time_column is not None and not isinstance(time_column, str):
+        raise QueryError("time_column must be a column name")
+
+    limit = spec.get('limit')
+    max_limit = _setting('MAX_LIMIT', 10_000)
+    if limit is None:
+        limit = _setting('DEFAULT_LIMIT', 1000)
+    elif not isinstance(limit, int) or isinstance(limit, bool) or limit < 0:
+        raise QueryError("limit must be a non-negative integer")
+    elif limit > max_limit:
+        raise QueryError(f"limit must be at most {max_limit}")
+
+    group_by = _list(spec, 'group_by')
+    if not all(isinstance(col, str) and col for col in group_by):
+        raise QueryError("group_by must be a list of column names")
+
+    return {
+        "dataset": dataset,
+        "measures": measures,
+        "group_by": group_by,
+        "filters": filters,
+        "time_grain": time_grain,
+        "time_column": time_column,
+        "sort": sort,
+        "limit": limit,
+    }
+
+
+def spec_hash(spec):
+    return hashlib.sha1(json.dumps(spec, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+# ---------------------------------------------------------------------------
+# Sources
+# ---------------------------------------------------------------------------
+
+def _time_column(df, requested=None):
+    if requested:
+        if requested not in df.columns:
+            raise QueryError(f"Unknown time column '{requested}'")
+        return requested
+    return next((col for col in df.columns if 'date' in col.lower()), None)
+
+
+class IndexedTable:
+    """Dataset with categorical dimensions, sorted by its time column"""
+
+    def __init__(self, df, time_column=None):
+        df = df.copy()
+        self.time_column = _time_column(df, time_column)
+        self.dimensions = []
+        for col in df.columns:
+            if col == self.time_column or not (df[col].dtype == object or isinstance(df[col].dtype, pd.CategoricalDtype)):
+                continue
+            if df[col].nunique(dropna=True) <= MAX_DIMENSION_CARDINALITY:
+                df[col] = df[col].astype('category')
+                self.dimensions.append(col)
+        if self.time_column:
+            df[self.time_column] = pd.to_datetime(df[self.time_column], errors='coerce')
+            df = df.sort_values(self.time_column, kind='stable', na_position='first').reset_index(drop=True)
+            self.times = df[self.time_column].to_numpy()
+            self._first_dated = int(np.isnat(self.times).sum())
+        self.frame = df
+
+    def time_slice(self, start=None, end=None, end_inclusive=True):
+        """Rows whose time falls in [start, end] via binary search"""
+        if not self.time_column or (start is None and end is None):
+            return self.frame
+        dated = self.times[self._first_dated:]
+        lo = dated.searchsorted(np.datetime64(start), 'left') if start is not None else 0
+        side = 'right' if end_inclusive else 'left'
+        hi = dated.searchsorted(np.datetime64(end), side) if end is not None else len(dated)
+        return self.frame.iloc[self._first_dated + lo:self._first_dated + hi]
+
+
+class Cube:
+    """Monthly pre-aggregate of an indexed table over some of its dimensions"""
+
+    def __init__(self, table, dimensions):
+        self.time_column = table.time_column
+        self.dimensions = list(dimensions)
+        self.numeric = [col for col in table.frame.columns
+                        if col not in self.dimensions and pd.api.types.is_numeric_dtype(table.frame[col])]
+        df = table.frame
+        keys = [df[col] for col in self.dimensions]
+        if self.time_column:
+            keys.append(df[self.time_column].dt.to_period('M').rename('__month'))
+        grouped = df.groupby(keys, observed=True, dropna=False)
+        self.cells = grouped.ngroup().to_numpy()  # Cube row of every table row, for sketches
+        parts = {"__rows": grouped.size()}
+        for col in self.numeric:
+            parts[f"{col}__sum"] = grouped[col].sum()
+            parts[f"{col}__count"] = grouped[col].count()
+            parts[f"{col}__min"] = grouped[col].min()
+            parts[f"{col}__max"] = grouped[col].max()
+        self.frame = pd.DataFrame(parts).reset_index()
+        self.source_rows = len(df)
+
+    def sketches(self, table, column, kind):
+        """One distinct-count or quantile sketch per cube row for a column"""
+        return sketch_cells(
+            table.frame[column], self.cells, len(self.frame), kind,
+            precision=_setting('HLL_PRECISION', 12), accuracy=_setting('QUANTILE_ACCURACY', 0.01),
+        )
+
+
+def _date(value):
+    try:
+        return pd.Timestamp(value)
+    except (TypeError, ValueError):
+        raise QueryError(f"Invalid date value '{value}'")
+
+
+def _end_of_day(value):
+    """A date without a time of day stands for the whole day as an upper bound"""
+    return value + pd.Timedelta(days=1) - pd.Timedelta(1, 'ns') if value == value.normalize() else value
+
+
+def _split_time_filters(filters, time_column):
+    """Separate range filters on the time column from the rest"""
+    start = end = None
+    rest = []
+    for item in filters:
+        if item['column'] == time_column and item['op'] in ('between', 'gte', 'lte'):
+            if item['op'] == 'between':
+                start, end = _date(item['value'][0]), _end_of_day(_date(item['value'][1]))
+            elif item['op'] == 'gte':
+                start = _date(item['value'])
+            else:
+                end = _end_of_day(_date(item['value']))
+        else:
+            rest.append(item)
+    return start, end, rest
+
+
+def _month_aligned(start, end):
+    starts_ok = start is None or start == start.to_period('M').start_time
+    ends_ok = end is None or end.normalize() == end.to_period('M').end_time.normalize()
+    return starts_ok and ends_ok
+
+
+def _cube_eligible(query, table, start, end, rest):
+    if query['time_grain'] not in CUBE_GRAINS or not _month_aligned(start, end):
+        return False
+    if query['time_grain'] and not table.time_column:
+        return False
+    columns = set(query['group_by']) | {item['column'] for item in rest}
+    if not columns <= set(table.dimensions):
+        return False
+    numeric = table.frame.select_dtypes('number').columns
+    for m in query['measures']:
+        if m['agg'] == 'distinct':
+            eligible = m['column'] in table.frame.columns and m['column'] != table.time_column
+        else:
+            eligible = m['column'] is None or (m['column'] in numeric and m['column'] not in table.dimensions)
+        if not eligible:
+            return False
+    return True
+
+
+# ---------------------------------------------------------------------------
+# Execution
+# ---------------------------------------------------------------------------
+
+def _mask(df, item):
+    column, op, value = item['column'], item['op'], item['value']
+    if column not in df.columns:
+        raise QueryError(f"Unknown filter column '{column}'")
+    series = df[column]
+    if pd.api.types.is_datetime64_any_dtype(series) and op not in ('in', 'not_in'):
+        value = [_date(v) for v in value] if isinstance(value, list) else _date(value)
+        if op == 'lte':
+            value = _end_of_day(value)
+        elif op == 'between':
+            value = [value[0], _end_of_day(value[1])]
+    elif op in RANGE_OPS:
+        # Ordering comparisons only make sense on numbers and dates
+        if not pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+            raise QueryError(f"Filter '{op}' needs a numeric or date column, '{column}' is not")
+        try:
+            value = [float(v) for v in value] if isinstance(value, list) else float(value)
+        except (TypeError, ValueError):
+            raise QueryError(f"Filter '{op}' on '{column}' needs numeric values")
+    if op == 'eq':
+        return series == value
+    if op == 'ne':
+        return series != value
+    if op == 'in':
+        return series.isin(value)
+    if op == 'not_in':
+        return ~series.isin(value)
+    if op == 'between':
+        return series.between(value[0], value[1])
+    return {'gt': series.gt, 'gte': series.ge, 'lt': series.lt, 'lte': series.le}[op](value)
+
+
+def _apply_filters(df, filters):
+    if not filters:
+        return df
+    mask = np.ones(len(df), dtype=bool)
+    for item in filters:
+        mask &= _mask(df, item).to_numpy(dtype=bool)
+    return df[mask]
+
+
+def _group_keys(df, query, time_column, period_column=None):
+    keys = []
+    for col in query['group_by']:
+        if col not in df.columns:
+            raise QueryError(f"Unknown group_by column '{col}'")
+        keys.append(df[col])
+    if query['time_grain']:
+        freq = TIME_GRAINS[query['time_grain']]
+        if period_column:
+            keys.append(df[period_column].dt.asfreq(freq).rename('period'))
+        elif time_column:
+            keys.append(df[time_column].dt.to_period(freq).rename('period'))
+        else:
+            raise QueryError("time_grain needs a dataset with a date column")
+    return keys
+
+
+def _exact(m):
+    """pandas aggregation for a measure over raw rows"""
+    if m['agg'] == 'distinct':
+        return 'nunique'
+    if m['agg'] == 'quantile':
+        return lambda series: series.quantile(m['q'])
+    return m['agg']
+
+
+def _aggregate_rows(df, query, time_column):
+    for m in query['measures']:
+        if m['column'] and m['column'] not in df.columns:
+            raise QueryError(f"Unknown measure column '{m['column']}'")
+        if m['agg'] in ('sum', 'mean', 'quantile') and not pd.api.types.is_numeric_dtype(df[m['column']]):
+            raise QueryError(f"Column '{m['column']}' is not numeric")
+    keys = _group_keys(df, query, time_column)
+    if not keys:
+        return pd.DataFrame([{
+            m['as']: (len(df) if m['agg'] == 'count' and not m['column'] else df[m['column']].agg(_exact(m)))
+            for m in query['measures']
+        }])
+    grouped = df.groupby(keys, observed=True, sort=False)
+    out = {}
+    for m in query['measures']:
+        out[m['as']] = grouped.size() if m['agg'] == 'count' and not m['column'] else grouped[m['column']].agg(_exact(m))
+    return pd.DataFrame(out).reset_index()
+
+
+def _aggregate_cube(cube_frame, query):
+    keys = _group_keys(cube_frame, query, None, period_column='__month' if query['time_grain'] else None)
+    partials = {}
+    for m in query['measures']:
+        col, agg = m['column'], m['agg']
+        if agg == 'count':
+            partials[m['as']] = ('sum', '__rows' if not col else f"{col}__count")
+        elif agg == 'mean':
+            partials[f"{m['as']}__sum"] = ('sum', f"{col}__sum")
+            partials[f"{m['as']}__count"] = ('sum', f"{col}__count")
+        elif agg == 'distinct':
+            partials[m['as']] = (lambda sketches: HyperLogLog.union(sketches).count(), f"{m['as']}__sketch")
+        elif agg == 'quantile':
+            partials[m['as']] = (lambda sketches, q=m['q']: QuantileSketch.union(sketches).quantile(q),
+                                 f"{m['as']}__sketch")
+        else:
+            partials[m['as']] = ('sum' if agg == 'sum' else agg, f"{col}__{agg}")
+    if keys:
+        grouped = cube_frame.groupby(keys, observed=True, sort=False)
+        result = pd.DataFrame({name: grouped[col].agg(how) for name, (how, col) in partials.items()}).reset_index()
+    else:
+        result = pd.DataFrame([{name: cube_frame[col].agg(how) for name, (how, col) in partials.items()}])
+    for m in query['measures']:
+        if m['agg'] == 'mean':
+            result[m['as']] = result.pop(f"{m['as']}__sum") / result.pop(f"{m['as']}__count").replace(0, np.nan)
+    return result
+
+
+def _finish(result, query, plan):
+    if query['sort']:
+        missing = [s['column'] for s in query['sort'] if s['column'] not in result.columns]
+        if missing:
+            raise QueryError(f"Unknown sort column(s): {', '.join(missing)}")
+        result = result.sort_values([s['column'] for s in query['sort']],
+                                    ascending=[not s['desc'] for s in query['sort']])
+    plan["rows"] = len(result)
+    plan["truncated"] = len(result) > query['limit']
+    result = result.head(query['limit'])
+    if 'period' in result.columns:
+        result['period'] = result['period'].astype(str)
+    return _records(result)
+
+
+def _records(result):
+    result = result.astype(object).where(result.notna(), None)
+    for col in result.columns:
+        result[col] = [v.item() if isinstance(v, np.generic) else (str(v) if isinstance(v, pd.Timestamp) else v)
+                       for v in result[col]]
+    return result.to_dict('records')
+
+
+def load_indexed_table(data_folder, dataset, version, time_column=None):
+    def compute():
+        df, _ = read_table(data_folder, dataset)
+        return IndexedTable(with_derived_columns(df, dataset), time_column) if df is not None else None
+
+    return analytics_cache.get_or_compute("query_index", version, compute, key=(data_folder, dataset, time_column))
+
+
+def cube_dimensions(query):
+    """Dimensions a query groups or filters by, which its cube is built over"""
+    return tuple(sorted(set(query['group_by']) | {item['column'] for item in query['filters']}))
+
+
+def load_cube(data_folder, dataset, version, table, dimensions, time_column=None):
+    """Cube for a dataset over some dimensions, or None when it would not be much smaller than the table"""
+    def compute():
+        cube = Cube(table, dimensions)
+        max_ratio = _setting('CUBE_MAX_RATIO', 0.25)
+        return cube if len(cube.frame) <= max_ratio * max(cube.source_rows, 1) else None
+
+    return analytics_cache.get_or_compute(
+        "query_cube", version, compute, key=(data_folder, dataset, time_column, dimensions),
+    )
+
+
+def load_cube_sketches(data_folder, dataset, version, table, cube, column, kind, time_column=None):
+    """Per-cell sketches of a column, built the first time a query needs them"""
+    return analytics_cache.get_or_compute(
+        "query_cube_sketches", version, lambda: cube.sketches(table, column, kind),
+        key=(data_folder, dataset, time_column, tuple(cube.dimensions), column, kind),
+    )
+
+
+def run_query(data_folder, spec):
+    """Plan and execute a query spec, caching the result per data version"""
+    query = parse_spec(spec)
+    dataset = query['dataset']
+    paths = dataset_files(data_folder, dataset)
+    if not paths:
+        raise FileNotFoundError(f"Dataset '{dataset}' not found")
+    version = data_version(data_folder, (dataset,))
+    if any(is_dated(dataset, column) for column in DERIVED.get(dataset, {})):
+        version = f"{version}-{date.today().isoformat()}"  # Derived columns age with the calendar
+
+    def compute():
+        if sum(os.path.getsize(path) for path in paths) < _setting('RAW_MAX_BYTES', 2 * 1024 * 1024):
+            df, _ = read_table(data_folder, dataset)
+            df = with_derived_columns(df, dataset)
+            time_column = _time_column(df, query['time_column'])
+            if time_column:
+                df[time_column] = pd.to_datetime(df[time_column], errors='coerce')
+            rows = _apply_filters(df, query['filters'])
+            plan = {"source": "raw", "rows_scanned": len(df)}
+            return _finish(_aggregate_rows(rows, query, time_column), query, plan), plan
+
+        table = load_indexed_table(data_folder, dataset, version, query['time_column'])
+        start, end, rest = _split_time_filters(query['filters'], table.time_column)
+        if _cube_eligible(query, table, start, end, rest):
+            dimensions = tuple(col for col in cube_dimensions(query) if col != table.time_column)
+            cube = load_cube(data_folder, dataset, version, table, dimensions, query['time_column'])
+            if cube is not None:
+                frame = cube.frame
+                if start is not None or end is not None:
+                    months = frame['__month']
+                    lower = start.to_period('M') if start is not None else months.min()
+                    upper = end.to_period('M') if end is not None else months.max()
+                    frame = frame[(months >= lower) & (months <= upper)]
+                frame = _apply_filters(frame, rest)
+                for m in query['measures']:
+                    if m['agg'] in SKETCH_AGGREGATIONS:
+                        sketches = load_cube_sketches(data_folder, dataset, version, table, cube,
+                                                      m['column'], m['agg'], query['time_column'])
+                        frame = frame.assign(**{f"{m['as']}__sketch": sketches[frame.index]})
+                plan = {"source": "cube", "rows_scanned": len(frame)}
+                return _finish(_aggregate_cube(frame, query), query, plan), plan
+
+        rows = table.time_slice(start, end)
+        plan = {"source": "index", "rows_scanned": len(rows)}
+        rows = _apply_filters(rows, rest)
+        return _finish(_aggregate_rows(rows, query, table.time_column), query, plan), plan
+
+    data, plan = analytics_cache.get_or_compute("query_result", version, compute, key=(data_folder, spec_hash(query)))
+    return {"data": data, "plan": plan, "data_version": version}
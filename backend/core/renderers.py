@@ -0,0 +1,113 @@
+"""
+Column-oriented response formats for chart and table payloads.
+
+Views may put a pandas DataFrame in Response.data instead of a list of
+dicts. The default JSON renderer still turns it into records, but clients
+that ask for ``?format=columnar`` (or Accept: application/vnd.bi.columnar+json)
+get one array per column, and ``?format=arrow`` (or Accept:
+application/vnd.apache.arrow.stream) gets an Arrow IPC stream; both are
+built from the frame's columns without constructing a dict per row.
+Lists of dicts are converted too, so every endpoint supports the formats.
+Arrow needs the optional pyarrow package and is only offered when it is
+installed (see REST_FRAMEWORK in settings).
+"""
+import json
+import sys
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+def is_frame(data):
+    # A DataFrame can only exist once pandas is imported, so don't import it just to check
+    pandas = sys.modules.get('pandas')
+    return pandas is not None and isinstance(data, pandas.DataFrame)
+
+
+def _is_records(data):
+    return isinstance(data, list) and bool(data) and all(isinstance(row, dict) for row in data)
+
+
+def _column_values(series):
+    """JSON-ready list of a column, with missing values as None"""
+    values = series.tolist()
+    if series.hasnans:
+        values = [None if value != value else value for value in values]
+    return values
+
+
+def frame_records(frame):
+    return [dict(zip(frame.columns, row)) for row in zip(*(_column_values(frame[col]) for col in frame.columns))]
+
+
+def columnar(data):
+    """{"length", "columns": {name: values}} for a frame or list of dicts; dicts convert their values"""
+    if is_frame(data):
+        return {"length": len(data), "columns": {str(col): _column_values(data[col]) for col in data.columns}}
+    if _is_records(data):
+        names = list(dict.fromkeys(key for row in data for key in row))
+        return {"length": len(data), "columns": {name: [row.get(name) for row in data] for name in names}}
+    if isinstance(data, dict):
+        return {key: columnar(value) if is_frame(value) or _is_records(value) else value for key, value in data.items()}
+    return data
+
+
+def _records(data):
+    if is_frame(data):
+        return frame_records(data)
+    if isinstance(data, dict):
+        return {key: frame_records(value) if is_frame(value) else value for key, value in data.items()}
+    return data
+
+
+class FrameJSONRenderer(JSONRenderer):
+    """The standard JSON renderer, accepting DataFrames as lists of records"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return super().render(_records(data), accepted_media_type, renderer_context)
+
+
+class ColumnarJSONRenderer(JSONRenderer):
+    media_type = 'application/vnd.bi.columnar+json'
+    format = 'columnar'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return super().render(columnar(data), accepted_media_type, renderer_context)
+
+
+class ArrowStreamRenderer(BaseRenderer):
+    """Arrow IPC stream of the payload's table.
+
+    A frame or list of dicts is the table. For a dict payload the first
+    table-like value is the table, its key is stored in the schema metadata
+    as ``table_key`` and the remaining keys as JSON under ``meta``. Error
+    payloads without a table come back as an empty table with ``meta``.
+    """
+    media_type = 'application/vnd.apache.arrow.stream'
+    format = 'arrow'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        import pyarrow as pa
+
+        metadata = {}
+        table = data
+        if isinstance(data, dict):
+            table_key = next((key for key, value in data.items() if is_frame(value) or _is_records(value)), None)
+            table = data.get(table_key) if table_key is not None else []
+            rest = {key: value for key, value in data.items() if key != table_key}
+            if table_key is not None:
+                metadata[b'table_key'] = str(table_key).encode()
+            metadata[b'meta'] = json.dumps(_records(rest), cls=JSONEncoder).encode()
+
+        if is_frame(table):
+            arrow_table = pa.Table.from_pandas(table, preserve_index=False)
+        else:
+            arrow_table = pa.Table.from_pylist(table if _is_records(table) else [])
+        if metadata:
+            arrow_table = arrow_table.replace_schema_metadata({**(arrow_table.schema.metadata or {}), **metadata})
+
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, arrow_table.schema) as writer:
+            writer.write_table(arrow_table)
+        return sink.getvalue().to_pybytes()
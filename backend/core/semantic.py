@@ -0,0 +1,199 @@
+"""
+Semantic layer: derived columns and metrics declared once.
+
+A derived column is declared with the columns it depends on (raw or other
+derived columns) and a function computing it from them; a metric is an
+aggregate of a raw or derived column of one table. SemanticLayer reads
+tables through read_table (partition files are cached there, and a full
+date range prunes partitions), computes derived columns on the filtered
+rows only, resolving dependencies, and memoises filtered frames with their
+derived columns, and metric values, in the analytics cache once per data
+version and filter set. Anything over columns that depend on today's date
+is also keyed on it. Memoised frames are handed out read-only: replacing a
+column only changes the caller's frame, writing into one raises.
+"""
+from datetime import date
+from core.lazy import lazy_import
+from core.cache import analytics_cache, data_version
+from core.utils import read_table
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+
+class DerivedColumn:
+    def __init__(self, table, name, depends, compute, dated=False):
+        self.table = table
+        self.name = name
+        self.depends = tuple(depends)
+        self.compute = compute  # f(column) -> Series, where column(name) returns a dependency
+        self.dated = dated  # Changes with today's date
+
+
+class Metric:
+    def __init__(self, name, table, column, agg='sum'):
+        self.name = name
+        self.table = table
+        self.column = column
+        self.agg = agg
+
+
+DERIVED = {}  # table -> column -> DerivedColumn
+METRICS = {}  # name -> Metric
+
+
+def derived(table, name, depends, dated=False):
+    """Declare a derived column of table, computed by the decorated function"""
+    def register(compute):
+        DERIVED.setdefault(table, {})[name] = DerivedColumn(table, name, depends, compute, dated)
+        return compute
+    return register
+
+
+def metric(name, table, column, agg='sum'):
+    METRICS[name] = Metric(name, table, column, agg)
+
+
+def is_dated(table, name):
+    """Whether a column depends, directly or through other derived columns, on today's date"""
+    column = DERIVED.get(table, {}).get(name)
+    return column is not None and (column.dated or any(is_dated(table, dep) for dep in column.depends))
+
+
+def filter_key(filters):
+    """Hashable, order-independent form of a filter dict; empty filters are dropped"""
+    return tuple(sorted(
+        (name, tuple(sorted(value)) if isinstance(value, (list, tuple, set)) else value)
+        for name, value in (filters or {}).items() if value
+    ))
+
+
+def _resolve(table, name, source, computed):
+    """Series for name computed from source (a frame), or None when a dependency is missing"""
+    if name in computed:
+        return computed[name]
+    column = DERIVED.get(table, {}).get(name)
+    if column is None:
+        value = source[name] if name in source.columns else None
+    elif name in source.columns:
+        value = source[name]  # The file already has it
+    else:
+        deps = {dep: _resolve(table, dep, source, computed) for dep in column.depends}
+        value = None if any(dep is None for dep in deps.values()) else column.compute(deps.__getitem__)
+    computed[name] = value
+    return value
+
+
+def add_derived(df, table, names=None):
+    """Add derived columns of table (all of them by default) whose dependencies df has"""
+    computed = {}
+    for name in (names if names is not None else DERIVED.get(table, {})):
+        if name not in df.columns:
+            value = _resolve(table, name, df, computed)
+            if value is not None:
+                df[name] = value
+    return df
+
+
+def read_only(df):
+    """Frame over read-only views of df's columns; its own columns can still be replaced"""
+    columns = {}
+    for name, column in df.items():
+        values = column.to_numpy()
+        if isinstance(values, np.ndarray) and values.dtype == column.dtype:
+            values = values.view()
+            values.flags.writeable = False
+            columns[name] = values
+        else:
+            columns[name] = column  # Extension arrays have no writeable flag
+    return pd.DataFrame(columns, index=df.index, copy=False)
+
+
+class SemanticLayer:
+    """Derived columns and memoised metrics over the tables of one data folder.
+
+    filter_fn(df, **filters) selects rows for a filter set. Filter sets with
+    both date_start and date_end also skip partitions outside that range,
+    matching filters that only apply a date range when both bounds are set.
+    """
+
+    def __init__(self, data_folder, filter_fn=None):
+        self.data_folder = data_folder
+        self.filter_fn = filter_fn
+
+    def version(self, table):
+        return data_version(self.data_folder, (table,))
+
+    def _dated_key(self, table, names):
+        return (date.today().isoformat(),) if any(is_dated(table, name) for name in names) else ()
+
+    def table(self, table, date_start=None, date_end=None):
+        """The table as read, pruned to partitions that may hold date_start..date_end when both are given"""
+        if date_start and date_end:
+            return read_table(self.data_folder, table, date_start=date_start, date_end=date_end)[0]
+        return read_table(self.data_folder, table)[0]
+
+    def frame(self, table, filters=None, columns=()):
+        """Filtered table with the requested derived columns added (read-only), or None if it is missing"""
+        filters = filters or {}
+        names = tuple(sorted({name for name in columns if name in DERIVED.get(table, {})}))
+
+        def compute():
+            df = self.table(table, filters.get('date_start'), filters.get('date_end'))
+            if df is None:
+                return None
+            if self.filter_fn is not None and any(filters.values()):
+                df = self.filter_fn(df, **filters)
+            return add_derived(df, table, names)
+
+        filter_fn = getattr(self.filter_fn, '__qualname__', None)
+        key = (self.data_folder, table, names, filter_fn, filter_key(filters)) + self._dated_key(table, names)
+        df = analytics_cache.get_or_compute("semantic_frame", self.version(table), compute, key=key)
+        return read_only(df) if df is not None else None
+
+    def value(self, name, filters=None):
+        """A declared metric over the rows selected by filters, or None if it cannot be computed"""
+        m = METRICS[name]
+
+        def compute():
+            df = self.frame(m.table, filters, [m.column])
+            if df is None or m.column not in df.columns:
+                return None
+            return getattr(df[m.column], m.agg)()
+
+        filter_fn = getattr(self.filter_fn, '__qualname__', None)
+        key = (self.data_folder, name, filter_fn, filter_key(filters)) + self._dated_key(m.table, [m.column])
+        return analytics_cache.get_or_compute("semantic_metric", self.version(m.table), compute, key=key)
+
+
+# ---------------------------------------------------------------------------
+# Declarations
+# ---------------------------------------------------------------------------
+
+@derived("ar_invoices", "outstanding", ("amount", "paid_amount"))
+@derived("ap_invoices", "outstanding", ("amount", "paid_amount"))
+def _outstanding(column):
+    return column('amount') - column('paid_amount').fillna(0)
+
+
+@derived("ar_invoices", "days_past_due", ("due_date",), dated=True)
+@derived("ap_invoices", "days_past_due", ("due_date",), dated=True)
+def _days_past_due(column):
+    return (pd.Timestamp(date.today()) - pd.to_datetime(column('due_date'), errors='coerce')).dt.days
+
+
+@derived("sales_flat", "lead_time_days", ("order_date", "delivery_date"))
+def _lead_time_days(column):
+    return (pd.to_datetime(column('delivery_date'), errors='coerce')
+            - pd.to_datetime(column('order_date'), errors='coerce')).dt.days
+
+
+@derived("inventory", "total_value", ("cost_per_unit", "quantity_on_hand"))
+def _total_value(column):
+    return column('cost_per_unit') * column('quantity_on_hand')
+
+
+metric("ar_outstanding", "ar_invoices", "outstanding")
+metric("ap_outstanding", "ap_invoices", "outstanding")
+metric("inventory_value", "inventory", "total_value")
+metric("sales_total", "sales_flat", "extended_price")
@@ -10,7 +10,10 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
+from importlib.util import find_spec
 from pathlib import Path
+from corsheaders.defaults import default_headers
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -50,11 +53,15 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "corsheaders.middleware.CorsMiddleware",
+    "core.admission.AdmissionControlMiddleware",
+    "django.middleware.gzip.GZipMiddleware",
+    "core.compression.BrotliMiddleware",  # Inside GZipMiddleware, so brotli wins when accepted
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "core.tenants.TenantMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -86,6 +93,19 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        "OPTIONS": {
+            # WAL lets readers run alongside the single writer; writers wait for the
+            # lock (busy_timeout, ms) instead of failing with "database is locked"
+            "init_command": (
+                "PRAGMA journal_mode=WAL;"
+                "PRAGMA synchronous=NORMAL;"
+                "PRAGMA busy_timeout=5000;"
+                "PRAGMA temp_store=MEMORY;"
+                "PRAGMA cache_size=-16000;"
+            ),
+            # Take the write lock when a transaction starts, so it cannot fail on upgrade
+            "transaction_mode": "IMMEDIATE",
+        },
     }
 }
 
@@ -134,7 +154,7 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 # Django REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'core.authentication.CachedTokenAuthentication',  # TokenAuthentication plus TOKEN_CACHE
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -143,8 +163,17 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
-    ],
+        'core.renderers.FrameJSONRenderer',
+        'core.renderers.ColumnarJSONRenderer',  # ?format=columnar
+    ] + (['core.renderers.ArrowStreamRenderer'] if find_spec('pyarrow') else []),  # ?format=arrow
+}
+
+# Brotli compression of large responses when the brotli package is installed (core/compression.py);
+# gzip is Django's GZipMiddleware
+RESPONSE_COMPRESSION = {
+    "ENABLED": True,
+    "MIN_BYTES": 1024,  # Smaller payloads are not brotli-compressed
+    "BROTLI_QUALITY": 5,
 }
 
 # CORS settings for frontend communication
@@ -154,10 +183,141 @@ CORS_ALLOWED_ORIGINS = [
 ]
 
 CORS_ALLOW_CREDENTIALS = True
+CORS_EXPOSE_HEADERS = ["X-Data-Version", "X-Stale", "Retry-After"]
+CORS_ALLOW_HEADERS = (*default_headers, "x-tenant")  # TENANTS["HEADER"]
 
 # Business Intelligence Settings
-DATA_FOLDER = "/Users/prathamgajjar/Downloads/MH"  # Path to CSV data files
+DATA_FOLDER = os.environ.get("BI_DATA_FOLDER", "/Users/prathamgajjar/Downloads/MH")  # Path to CSV data files
+
+# Tenants (core/tenants.py): business units with their own data folder and caches. Without
+# ROOTS every request runs as DEFAULT on DATA_FOLDER. Quotas are estimated bytes per tenant
+# and cache; a tenant over its quota evicts its own least recently used entries.
+TENANTS = {
+    "DEFAULT": "default",
+    # tenant -> data folder; BI_TENANT_ROOTS="retail=/data/retail,export=/data/export"
+    "ROOTS": dict(
+        item.split("=", 1) for item in os.environ.get("BI_TENANT_ROOTS", "").split(",") if "=" in item
+    ),
+    "USERS": {},  # username -> tenant, for token and session users; takes precedence over HEADER
+    "HEADER": "X-Tenant",
+    # Let authenticated users without a USERS entry pick any tenant with HEADER. Every such user
+    # can then read every tenant's data; anonymous requests are never allowed to pick one.
+    "ALLOW_HEADER": False,
+    "DEFAULT_QUOTA": {
+        "analytics": 1024 ** 3,
+        "partitions": 2 * 1024 ** 3,
+        "panels": 256 * 1024 ** 2,
+        "deltas": 128 * 1024 ** 2,
+        # "disk" (bytes per disk cache namespace) defaults to DISK_CACHE["MAX_BYTES"]
+    },
+    "QUOTAS": {},  # tenant -> overrides of DEFAULT_QUOTA, e.g. {"retail": {"partitions": 4 * 1024 ** 3}}
+}
 AZURE_OPENAI_KEY = ""  # Set via environment variables
 AZURE_OPENAI_ENDPOINT = ""
 AZURE_MODEL = "gpt-35-turbo-16k"
 AZURE_API_VERSION = "2024-02-15-preview"
+
+# Token authentication cache (core/authentication.py). Revoked tokens are dropped at
+# once in the process that revoked them and after at most TTL seconds elsewhere.
+TOKEN_CACHE = {
+    "ENABLED": True,
+    "TTL": 60.0,
+    "MAX_ENTRIES": 10_000,
+}
+
+# Admission control (core/admission.py): each cost class is a bulkhead with its own
+# concurrency limit and bounded wait queue. Keep the limits of the expensive classes
+# well below the server's worker threads so cheap requests always find one free.
+ADMISSION_CONTROL = {
+    "ENABLED": True,
+    "CLASSES": {
+        "llm": {"CONCURRENCY": 2, "QUEUE": 4, "TIMEOUT": 10.0, "PER_CLIENT": 1, "RETRY_AFTER": 10},
+        "heavy": {"CONCURRENCY": 4, "QUEUE": 16, "TIMEOUT": 5.0, "PER_CLIENT": 8, "RETRY_AFTER": 2},
+        # Exports stream for as long as the download takes; few at a time, one per client
+        "export": {"CONCURRENCY": 2, "QUEUE": 4, "TIMEOUT": 5.0, "PER_CLIENT": 1, "RETRY_AFTER": 10},
+        "light": {"CONCURRENCY": None},  # Unlimited; only the expensive classes are capped
+    },
+    # Path prefix -> cost class; the longest matching prefix wins
+    "ROUTES": {
+        "/api/finance/analytics/commentary/": "llm",
+        "/api/finance/dashboard/": "heavy",
+        "/api/finance/data/": "heavy",
+        "/api/finance/export/": "export",
+        "/api/finance/metrics/": "heavy",
+        "/api/query/": "heavy",
+    },
+    "DEFAULT_CLASS": "light",
+    "TRUST_X_FORWARDED_FOR": False,  # Only behind a proxy that sets it
+}
+
+# Stale-while-revalidate panel cache (core/panels.py)
+PANEL_CACHE = {
+    "ENABLED": True,
+    "MAX_ENTRIES": 512,  # Last good responses kept per worker
+    "WORKERS": 4,  # Threads recomputing panels in the background
+    "DEADLINE": 10.0,  # Seconds a request without a fallback waits before a 503
+    "DEADLINES": {"forecast": 20.0},  # Per-panel overrides
+    "DELTA_VERSIONS": 4,  # Past versions of each time series kept to answer ?since_version= (core/deltas.py)
+}
+
+# /api/finance/export/<stem>/ streaming downloads (finance/export.py)
+EXPORT = {
+    "STEMS": ["sales_flat", "ar_invoices", "ar_receipts", "ap_invoices", "gl_txn", "budget", "inventory"],
+    "CHUNK_ROWS": 50_000,  # Rows read, filtered and written at a time
+    "GZIP_LEVEL": 6,  # CSV is gzipped for clients sending Accept-Encoding: gzip
+}
+
+# /api/updates/ server-sent events of changed panels (core/updates.py); needs an ASGI server
+PANEL_UPDATES = {
+    "POLL_INTERVAL": 2.0,  # Seconds between checks of the data files while anyone is subscribed
+    "KEEPALIVE": 25.0,  # Seconds between keep-alive comments on an idle stream
+}
+
+# Startup: pandas/numpy are imported on first use (core/lazy.py)
+PRELOAD_MODULES = []  # e.g. ["pandas", "numpy"] to import them in wsgi/asgi before serving
+STARTUP_TIME_BUDGET = 2.0  # Seconds allowed for django.setup() plus URL resolution (finance/tests.py)
+
+# Analytics caching
+ANALYTICS_CACHE_MAX_ENTRIES = 256  # Computed results kept per worker, keyed by data version
+
+# Computed results and panel responses persisted across restarts and deploys (core/diskcache.py)
+DISK_CACHE = {
+    "ENABLED": True,
+    # Entries are unpickled when read, so this must only be writable by the server's user: it is
+    # created with mode 0700 and refused (persistence off) when owned by another user or
+    # group/world-writable. Never point it at a shared location such as /tmp.
+    "DIRECTORY": os.environ.get("BI_CACHE_DIR", str(BASE_DIR / ".cache" / "bi-hub")),
+    "MAX_BYTES": 2 * 1024 ** 3,  # Per namespace (analytics, partitions, panels); least recently used files go first
+    "MIN_COMPUTE_SECONDS": 0.05,  # Faster computations are not worth a disk write
+    # Code changes are detected from the source (core/diskcache.py); a release id set here also
+    # discards everything persisted by other releases
+    "CODE_VERSION": os.environ.get("BI_RELEASE", ""),
+}
+
+PARTITION_CACHE_MAX_ENTRIES = 128  # Parsed partition files of partitioned datasets
+CHART_MAX_POINTS = 1000  # Default LTTB cap on points per time-series chart
+TABLE_LOAD_WORKERS = 8  # Threads shared by concurrent per-request table loads
+
+# Partition-parallel aggregation (core/parallel.py)
+PARALLEL_AGGREGATION = {
+    "WORKERS": None,  # Process pool size; None uses every core
+    "MIN_BYTES": 64 * 1024 * 1024,  # Smaller inputs are aggregated serially in the request
+    "START_METHOD": "spawn",
+}
+
+# ?approx=true answers from a stratified sample of sales_flat (finance/sampling.py)
+APPROX_QUERY = {
+    "SAMPLE_FRACTION": 0.01,  # Share of each country x channel x month stratum kept
+    "MIN_STRATUM_ROWS": 200,  # Strata up to this size are kept whole and answered exactly
+    "CONFIDENCE": 0.95,
+}
+
+# /api/query/ planner
+QUERY_ENGINE = {
+    "RAW_MAX_BYTES": 2 * 1024 * 1024,  # Smaller files are aggregated straight from the parsed frame
+    "CUBE_MAX_RATIO": 0.25,  # Only keep a monthly cube when it is at most this fraction of the table
+    "HLL_PRECISION": 12,  # Distinct-count sketches: 2 ** 12 registers, ~1.6% standard error
+    "QUANTILE_ACCURACY": 0.01,  # Relative accuracy of quantiles answered from the cube
+    "DEFAULT_LIMIT": 1000,  # Rows returned when a query sets no limit
+    "MAX_LIMIT": 10_000,  # Largest limit a query may ask for
+}
@@ -0,0 +1,161 @@
+"""
+Mergeable sketches for distinct counts and quantiles.
+
+Both sketches are stored sparsely, so a cube cell that saw a handful of rows
+stays small, and both merge exactly: merging the sketches of a set of cells
+gives the sketch of their union. That lets the query cube keep one sketch
+per month x dimension cell and answer any filter combination by merging.
+
+* ``HyperLogLog`` - distinct counts with ~1.04 / sqrt(2 ** precision)
+  relative standard error.
+* ``QuantileSketch`` - log-bucketed (DDSketch-style) quantiles with a
+  guaranteed relative accuracy on every returned value.
+"""
+from core.lazy import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+HLL_PRECISION = 12
+QUANTILE_ACCURACY = 0.01
+QUANTILE_MIN_VALUE = 1e-6  # Magnitudes below this land in the zero bucket
+
+
+def hash_values(values):
+    """64-bit hashes of the non-null values of a column"""
+    values = pd.Series(values).dropna()
+    return pd.util.hash_array(values.to_numpy()) if len(values) else np.empty(0, dtype=np.uint64)
+
+
+class HyperLogLog:
+    """Distinct-count sketch; registers are kept as sorted (index, rank) pairs"""
+
+    def __init__(self, precision=HLL_PRECISION, index=None, rank=None):
+        self.precision = precision
+        self.index = index if index is not None else np.empty(0, dtype=np.uint32)
+        self.rank = rank if rank is not None else np.empty(0, dtype=np.uint8)
+
+    @staticmethod
+    def _registers(hashes, precision):
+        """Register index and rank (position of the first set bit) of each hash"""
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        width = 64 - precision
+        index = (hashes >> np.uint64(width)).astype(np.uint32)
+        rest = hashes & np.uint64((1 << width) - 1)
+        # rest < 2 ** 53, so the float conversion and frexp exponent are exact
+        _, bit_length = np.frexp(rest.astype(np.float64))
+        return index, (width - bit_length + 1).astype(np.uint8)
+
+    @classmethod
+    def _from_registers(cls, index, rank, precision):
+        dense = np.zeros(1 << precision, dtype=np.uint8)
+        np.maximum.at(dense, index, rank)
+        nonzero = np.flatnonzero(dense).astype(np.uint32)
+        return cls(precision, nonzero, dense[nonzero])
+
+    @classmethod
+    def from_hashes(cls, hashes, precision=HLL_PRECISION):
+        index, rank = cls._registers(hashes, precision)
+        return cls._from_registers(index, rank, precision)
+
+    @classmethod
+    def union(cls, sketches, precision=HLL_PRECISION):
+        """Sketch of the union of everything the given sketches saw"""
+        sketches = [s for s in sketches if s is not None]
+        if not sketches:
+            return cls(precision)
+        return cls._from_registers(
+            np.concatenate([s.index for s in sketches]), np.concatenate([s.rank for s in sketches]),
+            sketches[0].precision,
+        )
+
+    def count(self):
+        m = 1 << self.precision
+        if not len(self.index):
+            return 0
+        alpha = 0.7213 / (1 + 1.079 / m)
+        zeros = m - len(self.index)
+        estimate = alpha * m * m / (zeros + np.exp2(-self.rank.astype(np.float64)).sum())
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * np.log(m / zeros)  # Linear counting for small cardinalities
+        return int(round(estimate))
+
+
+class QuantileSketch:
+    """Relative-accuracy quantile sketch; buckets are kept as sorted (key, count) pairs.
+
+    Keys are order-preserving: 0 is the zero bucket, positive keys hold
+    positive values in geometrically growing buckets and negative keys
+    mirror them for negative values.
+    """
+
+    def __init__(self, accuracy=QUANTILE_ACCURACY, keys=None, counts=None):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.keys = keys if keys is not None else np.empty(0, dtype=np.int32)
+        self.counts = counts if counts is not None else np.empty(0, dtype=np.int64)
+
+    @staticmethod
+    def bucket_keys(values, accuracy=QUANTILE_ACCURACY):
+        """Bucket key of every non-null value"""
+        values = pd.Series(values).dropna().to_numpy(dtype=np.float64)
+        gamma = (1 + accuracy) / (1 - accuracy)
+        magnitude = np.abs(values)
+        keys = np.zeros(len(values), dtype=np.int32)
+        large = magnitude >= QUANTILE_MIN_VALUE
+        keys[large] = np.ceil(np.log(magnitude[large] / QUANTILE_MIN_VALUE) / np.log(gamma)).astype(np.int32) + 1
+        return np.where(values < 0, -keys, keys)
+
+    @classmethod
+    def from_keys(cls, keys, accuracy=QUANTILE_ACCURACY):
+        unique, counts = np.unique(keys, return_counts=True)
+        return cls(accuracy, unique.astype(np.int32), counts.astype(np.int64))
+
+    @classmethod
+    def union(cls, sketches, accuracy=QUANTILE_ACCURACY):
+        """Sketch of every value the given sketches saw"""
+        sketches = [s for s in sketches if s is not None]
+        if not sketches:
+            return cls(accuracy)
+        unique, inverse = np.unique(np.concatenate([s.keys for s in sketches]), return_inverse=True)
+        counts = np.bincount(inverse, weights=np.concatenate([s.counts for s in sketches])).astype(np.int64)
+        return cls(sketches[0].accuracy, unique.astype(np.int32), counts)
+
+    def _value(self, key):
+        if key == 0:
+            return 0.0
+        value = QUANTILE_MIN_VALUE * 2 * self.gamma ** (abs(key) - 1) / (self.gamma + 1)
+        return float(value if key > 0 else -value)
+
+    def quantile(self, q):
+        total = self.counts.sum()
+        if not total:
+            return None
+        rank = q * (total - 1)
+        position = int(np.searchsorted(np.cumsum(self.counts), rank, side='right'))
+        return self._value(self.keys[min(position, len(self.keys) - 1)])
+
+
+def sketch_cells(values, cells, n_cells, kind, precision=HLL_PRECISION, accuracy=QUANTILE_ACCURACY):
+    """One sketch per cell for a column, given each row's cell number.
+
+    kind is 'distinct' (HyperLogLog) or 'quantile' (QuantileSketch). Returns
+    an object array of length n_cells; cells without values get None.
+    """
+    values = pd.Series(np.asarray(values), copy=False)
+    notna = values.notna().to_numpy()
+    cells = np.asarray(cells)[notna]
+    if kind == 'distinct':
+        index, rank = HyperLogLog._registers(hash_values(values), precision)
+        build = lambda rows: HyperLogLog._from_registers(index[rows], rank[rows], precision)
+    else:
+        keys = QuantileSketch.bucket_keys(values, accuracy)
+        build = lambda rows: QuantileSketch.from_keys(keys[rows], accuracy)
+
+    sketches = np.full(n_cells, None, dtype=object)
+    order = np.argsort(cells, kind='stable')
+    boundaries = np.flatnonzero(np.diff(cells[order])) + 1
+    for rows in np.split(order, boundaries):
+        if len(rows):
+            sketches[cells[rows[0]]] = build(rows)
+    return sketches
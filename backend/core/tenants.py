@@ -0,0 +1,227 @@
+"""
+Tenants: business units served from their own data folder.
+
+TenantMiddleware picks the tenant of each request and keeps it in a
+context variable for the rest of the request. The tenant is taken from the
+user behind the request's token or session (TENANTS["USERS"]), otherwise
+it is DEFAULT. With TENANTS["ALLOW_HEADER"] on, authenticated users without
+a USERS entry may also pick one with the X-Tenant header. That lets every
+such user read every tenant's data, and it is off by default; anonymous
+requests can never pick a tenant, since the API's views are open to them
+and the header would otherwise hand any client any tenant. get_data_folder()
+returns the tenant's root from TENANTS["ROOTS"]; with no roots configured
+everything runs as DEFAULT on settings.DATA_FOLDER.
+
+Every cache (analytics and partition results, panel responses, delta
+snapshots, the disk cache) keeps one LRU per tenant, bounded by a byte
+quota per cache (TENANTS["QUOTAS"], falling back to DEFAULT_QUOTA), so a
+large tenant only ever evicts its own entries. Sizes are estimates: frames
+and arrays by their buffers, object columns and containers by sampling.
+
+Work handed to thread pools must run in a copy of the submitting context
+(submit_in_context) to stay in the tenant; worker processes get the tenant
+explicitly (run_in_tenant).
+"""
+import contextvars
+import sys
+from collections import OrderedDict
+from contextlib import contextmanager
+from django.conf import settings
+from django.http import JsonResponse
+
+_current = contextvars.ContextVar('bi_tenant', default=None)
+
+
+def _setting(name, default):
+    return getattr(settings, 'TENANTS', {}).get(name, default)
+
+
+def default_tenant():
+    return _setting('DEFAULT', 'default')
+
+
+def current_tenant():
+    """Tenant of the running request, or the default tenant outside of one"""
+    return _current.get() or default_tenant()
+
+
+def tenant_root(tenant):
+    """Data folder of a tenant, or None when it has no root of its own"""
+    root = _setting('ROOTS', {}).get(tenant)
+    return str(root) if root else None
+
+
+def is_tenant(name):
+    return name == default_tenant() or name in _setting('ROOTS', {})
+
+
+@contextmanager
+def use_tenant(tenant):
+    token = _current.set(tenant)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def run_in_tenant(tenant, fn, *args, **kwargs):
+    """fn(*args, **kwargs) as tenant; picklable with functools.partial for process pools"""
+    with use_tenant(tenant):
+        return fn(*args, **kwargs)
+
+
+def submit_in_context(pool, fn, *args, **kwargs):
+    """pool.submit running fn in a copy of the current context, so it keeps the tenant"""
+    return pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def quota(tenant, cache, default=None):
+    """Byte quota of one cache for a tenant, or default when none is configured"""
+    own = _setting('QUOTAS', {}).get(tenant, {})
+    if cache in own:
+        return own[cache]
+    return _setting('DEFAULT_QUOTA', {}).get(cache, default)
+
+
+# ---------------------------------------------------------------------------
+# Size estimates
+# ---------------------------------------------------------------------------
+
+SAMPLE = 100  # Items looked at per container or object column
+
+
+def _sampled(items, count):
+    """Items at an even stride, at most SAMPLE of them"""
+    step = max(1, count // SAMPLE)
+    return items[::step][:SAMPLE]
+
+
+def _pandas_size(value, pd):
+    size = int(value.memory_usage(index=True, deep=False).sum()) if isinstance(value, pd.DataFrame) \
+        else int(value.memory_usage(index=True, deep=False))
+    # Object columns hold pointers; add an estimate of what they point to
+    columns = value.items() if isinstance(value, pd.DataFrame) else [(value.name, value)]
+    for _, column in columns:
+        if column.dtype == object and len(column):
+            sample = _sampled(column.array, len(column))
+            size += int(sum(sys.getsizeof(item) for item in sample) / len(sample) * len(column))
+    return size
+
+
+def estimate_size(value, _depth=0):
+    """Approximate bytes held by a cached value"""
+    pd = sys.modules.get('pandas')
+    if pd is not None and isinstance(value, (pd.DataFrame, pd.Series)):
+        return _pandas_size(value, pd)
+    if hasattr(value, 'nbytes') and not callable(value.nbytes):
+        return int(value.nbytes)
+    size = sys.getsizeof(value)
+    if _depth >= 6:
+        return size
+    if isinstance(value, dict):
+        items = list(value.items()) if len(value) <= SAMPLE else _sampled(list(value.items()), len(value))
+        if items:
+            sampled = sum(estimate_size(k, _depth + 1) + estimate_size(v, _depth + 1) for k, v in items)
+            size += int(sampled / len(items) * len(value))
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        items = list(value) if isinstance(value, (set, frozenset)) else value
+        if items:
+            sample = _sampled(items, len(items))
+            size += int(sum(estimate_size(item, _depth + 1) for item in sample) / len(sample) * len(items))
+    elif hasattr(value, '__dict__') and not isinstance(value, type):
+        size += estimate_size(vars(value), _depth + 1)
+    return size
+
+
+class TenantLRU:
+    """LRU of key -> value per tenant, bounded by max_entries and the tenant's byte quota for cache.
+
+    Operations apply to the current tenant. Not thread-safe; callers hold
+    their own lock.
+    """
+
+    def __init__(self, cache, max_entries):
+        self.cache = cache
+        self.max_entries = max_entries
+        self._tenants = {}  # tenant -> OrderedDict(key -> (value, size))
+        self._bytes = {}  # tenant -> estimated bytes held
+
+    def get(self, key, default=None):
+        entries = self._tenants.get(current_tenant())
+        if entries is None or key not in entries:
+            return default
+        entries.move_to_end(key)
+        return entries[key][0]
+
+    def put(self, key, value, size=None):
+        tenant = current_tenant()
+        entries = self._tenants.setdefault(tenant, OrderedDict())
+        if key in entries:
+            self._bytes[tenant] -= entries.pop(key)[1]
+        size = estimate_size(value) if size is None else size
+        entries[key] = (value, size)
+        self._bytes[tenant] = self._bytes.get(tenant, 0) + size
+        limit = quota(tenant, self.cache)
+        # The newest entry stays even when it alone is over the quota
+        while len(entries) > 1 and (
+            len(entries) > self.max_entries or (limit is not None and self._bytes[tenant] > limit)
+        ):
+            self._bytes[tenant] -= entries.popitem(last=False)[1][1]
+
+    def clear(self):
+        self._tenants.clear()
+        self._bytes.clear()
+
+    def usage(self):
+        """{tenant: {"entries", "bytes"}} of what this cache holds"""
+        return {
+            tenant: {"entries": len(entries), "bytes": self._bytes.get(tenant, 0)}
+            for tenant, entries in self._tenants.items()
+        }
+
+
+# ---------------------------------------------------------------------------
+# Middleware
+# ---------------------------------------------------------------------------
+
+def request_user(request):
+    """Active user behind a request's token or session, or None for anonymous requests"""
+    from rest_framework.exceptions import AuthenticationFailed
+    from core.authentication import CachedTokenAuthentication
+    try:
+        authenticated = CachedTokenAuthentication().authenticate(request)
+        if authenticated is not None:
+            return authenticated[0]
+    except AuthenticationFailed:
+        pass  # The view rejects the token itself
+    session_user = getattr(request, 'user', None)
+    if session_user is not None and session_user.is_authenticated:
+        return session_user
+    return None
+
+
+class TenantMiddleware:
+    """Resolve the tenant of each request into the context"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.header = 'HTTP_' + _setting('HEADER', 'X-Tenant').upper().replace('-', '_')
+
+    def __call__(self, request):
+        asked = request.META.get(self.header)
+        if asked and not is_tenant(asked):
+            return JsonResponse({"error": f"Unknown tenant: {asked}"}, status=400)
+        users = _setting('USERS', {})
+        user = request_user(request) if users or asked else None
+        bound = users.get(user.get_username()) if user is not None else None
+        if bound is not None and asked and asked != bound:
+            return JsonResponse({"error": f"Not allowed for tenant {asked}"}, status=403)
+        # The API's views allow anonymous access, so the header is never trusted on its own
+        if bound is None and asked and (user is None or not _setting('ALLOW_HEADER', False)):
+            return JsonResponse({"error": "Tenant must come from the authenticated user"}, status=403)
+
+        request.tenant = bound or asked or default_tenant()
+        # Not reset afterwards: streaming responses are read after this returns, and
+        # every request sets it again
+        _current.set(request.tenant)
+        return self.get_response(request)
@@ -0,0 +1,365 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.http import JsonResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from core.admission import AdmissionControlMiddleware, CostClass
+from core.authentication import CachedTokenAuthentication, TokenCache, token_cache
+from core.cache import analytics_cache
+from core.lazy import lazy_import
+from core.panels import PanelCache
+from core.query import QueryError, parse_spec
+from core.tenants import current_tenant, use_tenant
+from core.updates import broker
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.response import Response
+
+pd = lazy_import('pandas')
+
+
+def write_tables(folder, **tables):
+    """Write each frame as <name>.csv in folder"""
+    for name, frame in tables.items():
+        frame.to_csv(f"{folder}/{name}.csv", index=False)
+
+
+def sales_frame(countries=("UAE", "KSA"), months=("2024-01", "2024-02", "2024-03"), rows_per_cell=50):
+    rows = []
+    for country in countries:
+        for month in months:
+            for i in range(rows_per_cell):
+                rows.append({
+                    "order_id": f"{country}-{month}-{i}",
+                    "order_date": f"{month}-{1 + i % 28:02d}",
+                    "country": country,
+                    "extended_price": float(i + 1),
+                })
+    return pd.DataFrame(rows)
+
+
+class DataFolderTestCase(SimpleTestCase):
+    """Runs against a temporary data folder holding the frames of make_tables()"""
+
+    def make_tables(self):
+        return {"sales_flat": sales_frame()}
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+        write_tables(self.folder, **self.make_tables())
+        settings = override_settings(DATA_FOLDER=self.folder)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+
+class ParseSpecTests(SimpleTestCase):
+    """Malformed specs are QueryErrors (400s), not crashes"""
+
+    def assertRejected(self, **spec):
+        with self.assertRaises(QueryError):
+            parse_spec({"dataset": "sales_flat", **spec})
+
+    def test_malformed_items(self):
+        self.assertRejected(filters=["x"])
+        self.assertRejected(filters="country")
+        self.assertRejected(filters=[{"op": "eq", "value": 1}])
+        self.assertRejected(sort=[{"desc": True}])
+        self.assertRejected(sort=[3])
+        self.assertRejected(measures=[3])
+        self.assertRejected(group_by="country")
+
+    def test_between_needs_two_values(self):
+        self.assertRejected(filters=[{"column": "order_date", "op": "between", "value": "2024-01"}])
+        self.assertRejected(filters=[{"column": "order_date", "op": "between", "value": ["2024-01"]}])
+
+    def test_limit(self):
+        self.assertRejected(limit=True)
+        self.assertRejected(limit=-1)
+        self.assertRejected(limit=10 ** 9)
+        self.assertEqual(parse_spec({"dataset": "sales_flat"})["limit"], 1000)
+
+    def test_shorthand(self):
+        spec = parse_spec({"dataset": "sales_flat", "measures": ["sum:extended_price", "p90:extended_price"],
+                           "sort": ["-sum_extended_price"]})
+        self.assertEqual([m["agg"] for m in spec["measures"]], ["sum", "quantile"])
+        self.assertEqual(spec["measures"][1]["q"], 0.9)
+        self.assertEqual(spec["sort"], [{"column": "sum_extended_price", "desc": True}])
+
+
+class QueryViewTests(DataFolderTestCase):
+
+    def query(self, **spec):
+        response = self.client.post('/api/query/', json.dumps({"dataset": "sales_flat", **spec}),
+                                    content_type='application/json')
+        return response.status_code, response.json()
+
+    def test_bad_specs_are_400(self):
+        for spec in ({"filters": ["x"]}, {"sort": [{"desc": True}]}, {"limit": True},
+                     {"filters": [{"column": "country", "op": "gt", "value": "A"}]},
+                     {"group_by": ["missing"]}):
+            status, body = self.query(**spec)
+            self.assertEqual(status, 400, (spec, body))
+
+    def test_unknown_dataset_is_404(self):
+        response = self.client.post('/api/query/', json.dumps({"dataset": "nothing"}), content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+    def test_rows_are_capped(self):
+        status, body = self.query(group_by=["order_id"], limit=10)
+        self.assertEqual(status, 200)
+        self.assertEqual(len(body["data"]), 10)
+        self.assertEqual(body["plan"]["rows"], 300)
+        self.assertTrue(body["plan"]["truncated"])
+
+    def test_end_date_covers_the_whole_day(self):
+        status, body = self.query(filters=[{"column": "order_date", "op": "between", "value": ["2024-01-01", "2024-01-01"]}])
+        self.assertEqual(status, 200)
+        self.assertEqual(body["data"], [{"count": 4}])  # 2 countries x rows 0 and 28 of the month
+
+    @override_settings(QUERY_ENGINE={"RAW_MAX_BYTES": 0})
+    def test_cube_over_queried_dimensions(self):
+        spec = {"group_by": ["country"], "time_grain": "month", "measures": ["sum:extended_price", "count"],
+                "sort": ["country", "period"]}
+        status, body = self.query(**spec)
+        self.assertEqual(status, 200)
+        self.assertEqual(body["plan"]["source"], "cube")
+        self.assertEqual(len(body["data"]), 6)
+        self.assertEqual(body["data"][0], {"country": "KSA", "period": "2024-01", "sum_extended_price": 1275.0,
+                                           "count": 50})
+
+
+class AdmissionControlTests(SimpleTestCase):
+    """A saturated cost class turns requests away, and streams hold their slot until closed"""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.response = None
+        self.cost_class = CostClass("heavy", concurrency=1, queue=0, timeout=0.01, per_client=1, retry_after=7)
+        self.middleware = AdmissionControlMiddleware(lambda request: self.response)
+        self.middleware.classes = {"heavy": self.cost_class}
+        self.middleware.routes = [("/api/", "heavy")]
+        self.middleware.default_class = None
+
+    def call(self, client):
+        return self.middleware(self.factory.get('/api/export/', REMOTE_ADDR=client))
+
+    def test_streaming_response_holds_its_slot(self):
+        self.response = StreamingHttpResponse(iter([b"a", b"b"]))
+        streaming = self.call("10.0.0.1")
+        self.assertEqual(streaming.status_code, 200)
+
+        same_client, other_client = self.call("10.0.0.1"), self.call("10.0.0.2")
+        self.assertEqual(same_client.status_code, 429)
+        self.assertEqual(other_client.status_code, 503)
+        self.assertEqual(other_client['Retry-After'], "7")
+
+        self.assertEqual(b"".join(streaming), b"ab")
+        self.assertEqual(self.cost_class.running, 0)
+        self.response = StreamingHttpResponse(iter([b"a"]))
+        self.assertEqual(self.call("10.0.0.2").status_code, 200)
+
+    def test_closing_an_unfinished_stream_releases(self):
+        self.response = StreamingHttpResponse(iter([b"a", b"b"]))
+        streaming = self.call("10.0.0.1")
+        next(iter(streaming))
+        streaming.close()
+        self.assertEqual(self.cost_class.running, 0)
+        self.assertEqual(self.cost_class._clients, {})
+
+    def test_plain_response_releases_at_once(self):
+        self.response = JsonResponse({})
+        for _ in range(3):
+            self.assertEqual(self.call("10.0.0.1").status_code, 200)
+        self.assertEqual(self.cost_class.running, 0)
+
+
+class PanelCacheTests(SimpleTestCase):
+    """Stale-while-revalidate: a deadline 503 while cold, the last good response while refreshing"""
+
+    def setUp(self):
+        self.cache = PanelCache(workers=1)
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def blocked(self, data):
+        def compute():
+            self.release.wait(5)
+            return Response(data)
+        return compute
+
+    def test_cold_panel_past_its_deadline_is_503(self):
+        response, version, stale = self.cache.serve("panel", "v1", self.blocked({"total": 1}), deadline=0.05)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], "1")
+
+        computation = self.cache._inflight[(current_tenant(), "panel", "v1")]
+        self.release.set()
+        computation.result(5)
+        response, version, stale = self.cache.serve("panel", "v1", self.blocked({"total": 2}), deadline=0.05)
+        self.assertEqual((response.status_code, response.data, version, stale), (200, {"total": 1}, "v1", False))
+
+    def test_new_version_serves_the_old_response_as_stale(self):
+        self.release.set()
+        self.cache.serve("panel", "v1", self.blocked({"total": 1}), deadline=5)
+        self.release.clear()
+
+        response, version, stale = self.cache.serve("panel", "v2", self.blocked({"total": 2}), deadline=5)
+        self.assertEqual((response.data, version, stale), ({"total": 1}, "v1", True))
+
+        refresh = self.cache._inflight[(current_tenant(), "panel", "v2")]
+        self.release.set()
+        refresh.result(5)
+        response, version, stale = self.cache.serve("panel", "v2", self.blocked({"total": 3}), deadline=5)
+        self.assertEqual((response.data, version, stale), ({"total": 2}, "v2", False))
+
+
+class PanelUpdatesTests(DataFolderTestCase):
+    """/api/updates/ sends a snapshot of panel versions, then the panels whose data changed"""
+
+    def make_tables(self):
+        invoices = pd.DataFrame({"invoice_id": ["INV-1"], "amount": [100.0], "due_date": ["2024-01-31"]})
+        return {"sales_flat": sales_frame(rows_per_cell=1), "ar_invoices": invoices}
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(setattr, broker, 'poll_interval', broker.poll_interval)
+        broker.poll_interval = 0.05
+
+    def touch(self, stem):
+        later = time.time() + 10
+        os.utime(f"{self.folder}/{stem}.csv", (later, later))
+
+    def test_polling_fallback(self):
+        response = self.client.get('/api/updates/?panels=aging,forecast')
+        self.assertEqual(set(response.json()["panels"]), {"aging", "forecast"})
+
+    async def test_snapshot_then_changed(self):
+        response = await self.async_client.get('/api/updates/?panels=aging,forecast')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = response.streaming_content.__aiter__()
+
+        snapshot = (await asyncio.wait_for(events.__anext__(), 5)).decode()
+        self.assertTrue(snapshot.startswith("event: snapshot\n"))
+        versions = json.loads(snapshot.split("data: ", 1)[1])["panels"]
+        self.assertEqual(set(versions), {"aging", "forecast"})
+
+        self.touch("ar_invoices")
+        changed = (await asyncio.wait_for(events.__anext__(), 5)).decode()
+        self.assertTrue(changed.startswith("event: changed\n"))
+        panels = json.loads(changed.split("data: ", 1)[1])["panels"]
+        self.assertEqual(list(panels), ["aging"])
+        self.assertNotEqual(panels["aging"], versions["aging"])
+
+        waiting = asyncio.ensure_future(events.__anext__())
+        await asyncio.sleep(0.1)
+        waiting.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+        self.assertNotIn(self.folder, broker._subscribers)
+
+
+class TokenCacheTests(TestCase):
+    """Cached token lookups are dropped as soon as the token or its user changes"""
+
+    def setUp(self):
+        token_cache.clear()
+        self.addCleanup(token_cache.clear)
+        self.user = get_user_model().objects.create_user("analyst", password="secret")
+        self.token = Token.objects.create(user=self.user)
+        self.auth = CachedTokenAuthentication()
+
+    def authenticate(self):
+        return self.auth.authenticate_credentials(self.token.key)
+
+    def test_repeated_keys_skip_the_database(self):
+        self.authenticate()
+        with self.assertNumQueries(0):
+            user, token = self.authenticate()
+        self.assertEqual((user, token), (self.user, self.token))
+
+    def test_deleted_token_is_refused(self):
+        self.authenticate()
+        self.token.delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_saving_the_token_discards_it(self):
+        self.authenticate()
+        self.token.save()
+        self.assertIsNone(token_cache.get(self.token.key))
+
+    def test_deactivated_user_is_refused(self):
+        self.authenticate()
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_deleted_user_is_refused(self):
+        self.authenticate()
+        self.user.delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_entries_expire(self):
+        cache = TokenCache(ttl=0)
+        cache.put(self.token.key, self.user, self.token)
+        self.assertIsNone(cache.get(self.token.key))
+
+
+class TenantTests(TestCase):
+    """Requests only reach the data and cache entries of their own tenant"""
+
+    def setUp(self):
+        self.enterContext(use_tenant(None))  # The middleware leaves the tenant set in this thread
+        self.roots = {}
+        for tenant, countries in (("east", ("UAE",)), ("west", ("UAE", "KSA"))):
+            self.roots[tenant] = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, self.roots[tenant], ignore_errors=True)
+            write_tables(self.roots[tenant], sales_flat=sales_frame(countries=countries))
+        self.enterContext(override_settings(TENANTS={
+            **settings.TENANTS, "ROOTS": self.roots, "USERS": {"alice": "east", "bob": "west"},
+        }))
+        self.tokens = {
+            name: Token.objects.create(user=get_user_model().objects.create_user(name)).key
+            for name in ("alice", "bob", "carol")
+        }
+
+    def query(self, user=None, tenant=None):
+        headers = {}
+        if user:
+            headers['HTTP_AUTHORIZATION'] = f"Token {self.tokens[user]}"
+        if tenant:
+            headers['HTTP_X_TENANT'] = tenant
+        return self.client.get('/api/query/', {"spec": json.dumps({"dataset": "sales_flat"})}, **headers)
+
+    def test_users_get_their_own_tenant(self):
+        east, west = self.query("alice").json(), self.query("bob").json()
+        self.assertEqual(east["data"], [{"count": 150}])
+        self.assertEqual(west["data"], [{"count": 300}])
+        usage = analytics_cache._entries.usage()
+        self.assertIn("east", usage)
+        self.assertIn("west", usage)
+
+    def test_bound_user_cannot_pick_another_tenant(self):
+        self.assertEqual(self.query("bob", tenant="east").status_code, 403)
+        self.assertEqual(self.query("bob", tenant="west").json()["data"], [{"count": 300}])
+
+    def test_anonymous_requests_cannot_pick_a_tenant(self):
+        self.assertEqual(self.query(tenant="east").status_code, 403)
+
+    def test_unknown_tenant(self):
+        self.assertEqual(self.query("alice", tenant="north").status_code, 400)
+
+    def test_header_for_unbound_users(self):
+        self.assertEqual(self.query("carol", tenant="east").status_code, 403)
+        with override_settings(TENANTS={**settings.TENANTS, "ALLOW_HEADER": True}):
+            self.assertEqual(self.query("carol", tenant="east").json()["data"], [{"count": 150}])
+            self.assertEqual(self.query(tenant="east").status_code, 403)
@@ -0,0 +1,99 @@
+"""
+Push notifications of panel data versions over server-sent events.
+
+Dashboards subscribe to /api/updates/ instead of polling every panel. The
+broker watches the data versions of the registered panels (core/panels.py)
+and tells each subscriber which panels changed and their new version, the
+same ``data_version`` the panel responses carry, so a client refetches
+only the panels whose version differs from the one it holds.
+
+One watcher task runs per data folder and process, and only while someone
+is subscribed. It stats the data files every POLL_INTERVAL seconds in a
+worker thread. Idle connections only receive a keep-alive comment now and
+then.
+"""
+import asyncio
+import json
+import logging
+from django.conf import settings
+from core.panels import panel_versions
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name, default):
+    return getattr(settings, 'PANEL_UPDATES', {}).get(name, default)
+
+
+class VersionBroker:
+    """Fan-out of panel version changes to the subscribers of each data folder"""
+
+    def __init__(self, poll_interval=2.0):
+        self.poll_interval = poll_interval
+        self._subscribers = {}  # data folder -> set of queues
+        self._watchers = {}  # data folder -> watcher task
+        self._versions = {}  # data folder -> last published panel versions
+
+    async def subscribe(self, data_folder):
+        """Queue receiving {panel: version} dicts of changed panels; the first holds every panel"""
+        versions = await asyncio.to_thread(panel_versions, data_folder)
+        queue = asyncio.Queue()
+        queue.put_nowait(versions)
+        self._subscribers.setdefault(data_folder, set()).add(queue)
+        self._versions.setdefault(data_folder, versions)
+        watcher = self._watchers.get(data_folder)
+        if watcher is None or watcher.done():
+            self._watchers[data_folder] = asyncio.create_task(self._watch(data_folder))
+        return queue
+
+    def unsubscribe(self, data_folder, queue):
+        subscribers = self._subscribers.get(data_folder, set())
+        subscribers.discard(queue)
+        if not subscribers:
+            # The watcher notices and stops; the next subscriber starts from fresh versions
+            self._subscribers.pop(data_folder, None)
+            self._versions.pop(data_folder, None)
+
+    async def _watch(self, data_folder):
+        while self._subscribers.get(data_folder):
+            await asyncio.sleep(self.poll_interval)
+            try:
+                versions = await asyncio.to_thread(panel_versions, data_folder)
+            except Exception:
+                logger.exception("Could not read data versions of %s", data_folder)
+                continue
+            previous = self._versions.get(data_folder, {})
+            changed = {name: version for name, version in versions.items() if previous.get(name) != version}
+            if changed:
+                self._versions[data_folder] = versions
+                for queue in list(self._subscribers.get(data_folder, ())):
+                    queue.put_nowait(changed)
+        self._watchers.pop(data_folder, None)
+
+
+broker = VersionBroker(_setting('POLL_INTERVAL', 2.0))
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def panel_events(data_folder, panels=None):
+    """Server-sent event stream: a snapshot of panel versions, then the panels that change"""
+    keepalive = _setting('KEEPALIVE', 25.0)
+    queue = await broker.subscribe(data_folder)
+    try:
+        event = "snapshot"
+        while True:
+            try:
+                versions = await asyncio.wait_for(queue.get(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if panels:
+                versions = {name: version for name, version in versions.items() if name in panels}
+            if versions or event == "snapshot":
+                yield sse_event(event, {"panels": versions})
+            event = "changed"
+    finally:
+        broker.unsubscribe(data_folder, queue)
@@ -18,10 +18,13 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework.authtoken.views import obtain_auth_token
+from core.views import QueryView, PanelUpdatesView
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/auth/token/", obtain_auth_token, name="api_token_auth"),
+    path("api/query/", QueryView.as_view(), name="api-query"),
+    path("api/updates/", PanelUpdatesView.as_view(), name="api-updates"),
     path("api/finance/", include("finance.urls")),
     path("api/order-journey/", include("order_journey.urls")),
     path("api/marketing/", include("marketing.urls")),
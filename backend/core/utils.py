@@ -1,11 +1,20 @@
 """
 Shared utility functions for Business Intelligence Hub
 """
+from __future__ import annotations
+
 import os
+import re
 import glob
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import pandas as pd
+from core.lazy import lazy_import
 from django.conf import settings
+from core.tenants import current_tenant, submit_in_context, tenant_root
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
 
 
 def fmt_aed(x, decimals: int = 0):
@@ -16,10 +25,14 @@ def fmt_aed(x, decimals: int = 0):
         return f"AED {x}"
 
 
+DATA_EXTENSIONS = ('csv', 'xlsx', 'xls')
+PARTITION_KEY = re.compile(r'(?<!\d)(\d{4})(?:[_-]?(\d{2}))?(?!\d)')
+
+
 def find_path(folder: str, stem: str):
     """Find first matching path for a stem: tries exact stem.csv/xlsx/xls, then wildcards"""
     candidates = []
-    for ext in ('csv', 'xlsx', 'xls'):
+    for ext in DATA_EXTENSIONS:
         exact = os.path.join(folder, f"{stem}.{ext}")
         if os.path.exists(exact):
             return exact
@@ -28,19 +41,191 @@ def find_path(folder: str, stem: str):
     return candidates[0] if candidates else None
 
 
-def read_table(folder: str, stem: str):
-    """Read CSV or Excel table from data folder"""
+PARTITION_YEARS = range(1900, 2262)  # Other four-digit runs (part-0001, data_9999) are not dates
+
+
+def _partition_range(name: str):
+    """(start, end) covered by a partition named like 2024, 2024-03 or 202403; (None, None) if undated"""
+    for match in PARTITION_KEY.finditer(name):
+        year, month = int(match.group(1)), match.group(2)
+        if year not in PARTITION_YEARS:
+            continue
+        if month and 1 <= int(month) <= 12:
+            period = pd.Period(year=year, month=int(month), freq='M')
+        else:
+            period = pd.Period(year=year, freq='Y')
+        return period.start_time, period.end_time
+    return None, None
+
+
+def find_partitions(folder: str, stem: str):
+    """Partitions of a dataset as (path, start, end), or [] if it is a single file.
+
+    A dataset is partitioned when it has a directory ``<stem>/`` of data files,
+    or files named ``<stem>_<YYYY>`` / ``<stem>_<YYYY>-<MM>`` (any of _ - or no
+    separator before the month). A plain ``<stem>.csv`` next to dated files is
+    read as an undated partition, e.g. the current period's export.
+    """
+    directory = os.path.join(folder, stem)
+    if os.path.isdir(directory):
+        paths = sorted(p for ext in DATA_EXTENSIONS for p in glob.glob(os.path.join(directory, f"*.{ext}")))
+        return [(p, *_partition_range(os.path.splitext(os.path.basename(p))[0])) for p in paths]
+
+    dated = re.compile(rf'^(?:{re.escape(stem)}|{re.escape(stem.capitalize())})[_-]\d{{4}}(?:[_-]?\d{{2}})?$')
+    partitions = []
+    for ext in DATA_EXTENSIONS:
+        for path in glob.glob(os.path.join(folder, f"*.{ext}")):
+            name = os.path.splitext(os.path.basename(path))[0]
+            if dated.match(name):
+                partitions.append((path, *_partition_range(name[len(stem):])))
+    if not partitions:
+        return []
+    for ext in DATA_EXTENSIONS:
+        exact = os.path.join(folder, f"{stem}.{ext}")
+        if os.path.exists(exact):
+            partitions.append((exact, None, None))
+    return sorted(partitions)
+
+
+def dataset_files(folder: str, stem: str):
+    """Every file backing a dataset, partitioned or not"""
+    partitions = find_partitions(folder, stem)
+    if partitions:
+        return [path for path, _, _ in partitions]
+    path = find_path(folder, stem)
+    return [path] if path else []
+
+
+def _read_file(path: str):
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ('.xlsx', '.xls'):
+        return pd.read_excel(path)
+    return pd.read_csv(path)
+
+
+def _read_partition(path: str):
+    """Parsed partition, cached until that one file changes"""
+    from core.cache import partition_cache, file_signature
+    return partition_cache.get_or_compute(
+        "partition", repr(file_signature(path)), lambda: _read_file(path), key=(path,)
+    )
+
+
+def _select_partitions(partitions, date_start=None, date_end=None):
+    """Paths of the partitions that may hold rows in date_start..date_end (undated ones always)"""
+    start = pd.Timestamp(date_start) if date_start else None
+    end = pd.Timestamp(date_end) if date_end else None
+    return [
+        path for path, p_start, p_end in partitions
+        if p_start is None
+        or ((end is None or p_start <= end) and (start is None or p_end >= start))
+    ]
+
+
+def read_table(folder: str, stem: str, date_start=None, date_end=None):
+    """Read CSV or Excel table from data folder.
+
+    Partitioned datasets are read as one table; with date_start/date_end,
+    partitions entirely outside the range are skipped (rows are not filtered).
+    """
+    partitions = find_partitions(folder, stem)
+    if partitions:
+        selected = _select_partitions(partitions, date_start, date_end)
+        if not selected:
+            return _read_partition(partitions[0][0]).iloc[0:0].copy(), os.path.join(folder, stem)
+        return pd.concat([_read_partition(path) for path in selected], ignore_index=True), os.path.join(folder, stem)
+
     path = find_path(folder, stem)
     if not path:
         return None, None
     
-    ext = os.path.splitext(path)[1].lower()
-    if ext in ('.xlsx', '.xls'):
-        df = pd.read_excel(path)
+    return _read_file(path), path
+
+
+def iter_table_chunks(folder: str, stem: str, chunk_rows: int, date_start=None, date_end=None):
+    """Yield a table as DataFrames of at most chunk_rows rows without loading it whole.
+
+    CSV files are parsed incrementally; Excel files have no incremental
+    reader and are read one file at a time. Partition pruning works as in
+    read_table. Yields nothing if the dataset does not exist.
+    """
+    partitions = find_partitions(folder, stem)
+    if partitions:
+        paths = _select_partitions(partitions, date_start, date_end)
     else:
-        df = pd.read_csv(path)
-    
-    return df, path
+        path = find_path(folder, stem)
+        paths = [path] if path else []
+    for path in paths:
+        if os.path.splitext(path)[1].lower() in ('.xlsx', '.xls'):
+            df = pd.read_excel(path)
+            for offset in range(0, len(df), chunk_rows):
+                yield df.iloc[offset:offset + chunk_rows]
+        else:
+            with pd.read_csv(path, chunksize=chunk_rows) as reader:
+                yield from reader
+
+
+def table_columns(folder: str, stem: str):
+    """Column names of a dataset across all its files, in first-seen order, or None if it does not exist"""
+    paths = dataset_files(folder, stem)
+    if not paths:
+        return None
+    columns = {}
+    for path in paths:
+        if os.path.splitext(path)[1].lower() in ('.xlsx', '.xls'):
+            header = pd.read_excel(path, nrows=0).columns
+        else:
+            header = pd.read_csv(path, nrows=0).columns
+        columns.update(dict.fromkeys(header))
+    return list(columns)
+
+
+_loader_pool = None
+_loader_pool_lock = threading.Lock()
+
+
+def _table_loader_pool():
+    global _loader_pool
+    with _loader_pool_lock:
+        if _loader_pool is None:
+            _loader_pool = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'TABLE_LOAD_WORKERS', 8), thread_name_prefix='table-loader'
+            )
+        return _loader_pool
+
+
+def load_tables(folder: str, stems, date_start=None, date_end=None, prune=(), loaders=None):
+    """Read several tables concurrently on a bounded thread pool.
+
+    pandas' parsers release the GIL, so a cold request pays for the slowest
+    table rather than the sum of all of them. Stems listed in ``prune`` skip
+    partitions outside date_start..date_end (only when both are given, as
+    with the row filters). ``loaders`` maps a stem to a callable used
+    instead of read_table, e.g. a cached derived table. Returns
+    (tables, errors): a missing table is None, and a table that fails to
+    load is None with its error captured in errors instead of failing the
+    whole request.
+    """
+    loaders = loaders or {}
+
+    def load(stem):
+        if stem in loaders:
+            return loaders[stem]()
+        if stem in prune and date_start and date_end:
+            return read_table(folder, stem, date_start=date_start, date_end=date_end)[0]
+        return read_table(folder, stem)[0]
+
+    stems = list(dict.fromkeys(stems))
+    pool = _table_loader_pool()
+    futures = {stem: submit_in_context(pool, load, stem) for stem in stems}
+    tables, errors = {}, {}
+    for stem, future in futures.items():
+        try:
+            tables[stem] = future.result()
+        except Exception as e:
+            tables[stem] = None
+            errors[stem] = str(e)
+    return tables, errors
 
 
 def ensure_dates(df: pd.DataFrame, cols):
@@ -51,9 +236,31 @@ def ensure_dates(df: pd.DataFrame, cols):
     return df
 
 
+def lttb_indices(x, y, threshold: int):
+    """Indices of the points kept by Largest-Triangle-Three-Buckets downsampling"""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # First and last points are always kept; the rest is split into equal buckets
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    kept = [0]
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        prev_x, prev_y = x[kept[-1]], y[kept[-1]]
+        area = np.abs((prev_x - avg_x) * (y[start:end] - prev_y) - (prev_x - x[start:end]) * (avg_y - prev_y))
+        kept.append(start + int(area.argmax()))
+    kept.append(n - 1)
+    return np.array(kept)
+
+
 def get_data_folder():
-    """Get the data folder path from settings"""
-    return getattr(settings, 'DATA_FOLDER', '/Users/prathamgajjar/Downloads/MH')
+    """Data folder of the current tenant (core/tenants.py), else the one from settings"""
+    return tenant_root(current_tenant()) or getattr(settings, 'DATA_FOLDER', '/Users/prathamgajjar/Downloads/MH')
 
 
 # Currency conversion constants
@@ -0,0 +1,64 @@
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework import status
+import json
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views import View
+from core.utils import get_data_folder
+from core.query import run_query, QueryError
+from core.panels import panel_versions
+from core.updates import panel_events
+
+
+class QueryView(APIView):
+    """Generic aggregation query over a dataset in the data folder"""
+    
+    def post(self, request):
+        return self.run(request, request.data)
+    
+    def get(self, request):
+        # GET ?spec=<json> makes simple tiles cacheable by the browser
+        try:
+            spec = json.loads(request.GET.get('spec', ''))
+        except ValueError:
+            return Response(
+                {"error": "spec must be a JSON-encoded query"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return self.run(request, spec)
+    
+    def run(self, request, spec):
+        try:
+            return Response(run_query(get_data_folder(), spec), status=status.HTTP_200_OK)
+        except QueryError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except FileNotFoundError as e:
+            return Response({"error": str(e)}, status=status.HTTP_404_NOT_FOUND)
+        except Exception as e:
+            return Response(
+                {"error": f"Error running query: {str(e)}"}, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class PanelUpdatesView(View):
+    """Server-sent events announcing which dashboard panels have new data.
+
+    ?panels=a,b limits the stream to those panels. Without an ASGI server
+    the stream cannot be held open, so the current versions are returned as
+    JSON instead for clients to poll.
+    """
+    
+    async def get(self, request):
+        data_folder = get_data_folder()
+        panels = {name for value in request.GET.getlist('panels') for name in value.split(',') if name}
+        if not isinstance(request, ASGIRequest):
+            versions = await sync_to_async(panel_versions)(data_folder, panels or None)
+            return JsonResponse({"panels": versions})
+        
+        response = StreamingHttpResponse(panel_events(data_folder, panels), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # Keep nginx from buffering the stream
+        return response
@@ -0,0 +1,120 @@
+"""
+Chart-of-accounts classification for GL transactions.
+
+Each distinct account is classified once per data version and the result is
+stored on the ledger as a categorical ``account_class`` column, so revenue
+and expense selections are integer comparisons on the category codes rather
+than regex scans over every row.
+"""
+import re
+from core.lazy import lazy_import
+from core.cache import analytics_cache, data_version
+from core.utils import read_table, ensure_dates
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+ACCOUNT_CLASSES = ["revenue", "cogs", "opex", "asset", "liability", "equity", "unclassified"]
+EXPENSE_CLASSES = ("cogs", "opex")
+PNL_CLASSES = ("revenue",) + EXPENSE_CLASSES  # Income statement; the rest is balance sheet
+GL_DATE_COLUMNS = ['date', 'transaction_date', 'created_date']
+ACCOUNT_MAP_STEM = "account_map"  # Optional override file: account, account_class
+GL_STEMS = ("gl_txn", ACCOUNT_MAP_STEM)  # Files the classified GL is built from
+
+# First match wins; account_type is checked before the account name. Cost and
+# expense patterns come before revenue so "Cost of Sales" and "Income Tax
+# Expense" are not taken for revenue.
+TYPE_PATTERNS = [
+    ("cogs", re.compile(r"cogs|cost of (goods|sales|revenue)", re.I)),
+    ("opex", re.compile(r"expense|cost", re.I)),
+    ("revenue", re.compile(r"revenue|income|sales", re.I)),
+    ("asset", re.compile(r"asset", re.I)),
+    ("liability", re.compile(r"liabilit", re.I)),
+    ("equity", re.compile(r"equity", re.I)),
+]
+NAME_PATTERNS = [
+    ("cogs", re.compile(r"cogs|cost of (goods|sales|revenue)|purchases", re.I)),
+    ("liability", re.compile(r"payable|liabilit", re.I)),  # "Sales Tax Payable"
+    ("opex", re.compile(r"expense|\btax(es)?\b", re.I)),  # "Income Tax"
+    ("revenue", re.compile(r"sales|revenue|income", re.I)),
+    ("opex", re.compile(r"salar|wage|rent|utilit|marketing|admin|depreciation|travel|insurance", re.I)),
+    ("asset", re.compile(r"asset|cash|bank|receivable|inventory", re.I)),
+    ("liability", re.compile(r"loan|accru", re.I)),
+    ("equity", re.compile(r"equity|capital|retained", re.I)),
+]
+KEY_COLUMNS = ['account', 'account_name', 'account_type']
+
+
+def _match(patterns, text):
+    for name, pattern in patterns:
+        if pattern.search(text):
+            return name
+    return None
+
+
+def classify_account(account="", account_name="", account_type=""):
+    """Class of a single chart-of-accounts entry"""
+    name_class = _match(NAME_PATTERNS, f"{account} {account_name}")
+    type_class = _match(TYPE_PATTERNS, account_type)
+    if type_class == "opex" and name_class == "cogs":
+        return "cogs"
+    return type_class or name_class or "unclassified"
+
+
+def class_codes(*classes):
+    """Category codes for the given class names"""
+    return np.array([ACCOUNT_CLASSES.index(c) for c in classes])
+
+
+def class_mask(gl_txn, *classes):
+    """Boolean mask of GL rows in any of the given classes"""
+    return np.isin(gl_txn['account_class'].cat.codes.to_numpy(), class_codes(*classes))
+
+
+def _load_overrides(data_folder):
+    overrides, _ = read_table(data_folder, ACCOUNT_MAP_STEM)
+    if overrides is None or 'account' not in overrides.columns:
+        return {}
+    class_col = 'account_class' if 'account_class' in overrides.columns else 'class'
+    if class_col not in overrides.columns:
+        return {}
+    mapping = overrides[['account', class_col]].dropna()
+    mapping[class_col] = mapping[class_col].astype(str).str.strip().str.lower()
+    mapping = mapping[mapping[class_col].isin(ACCOUNT_CLASSES)]
+    return dict(zip(mapping['account'].astype(str), mapping[class_col]))
+
+
+def classify_gl(gl_txn, overrides=None):
+    """Add a categorical account_class column, classifying each distinct account once"""
+    overrides = overrides or {}
+    key_cols = [col for col in KEY_COLUMNS if col in gl_txn.columns]
+    if not key_cols:
+        codes = np.full(len(gl_txn), ACCOUNT_CLASSES.index("unclassified"))
+    else:
+        keys = gl_txn[key_cols].fillna('').astype(str)
+        row_codes, uniques = pd.factorize(pd.MultiIndex.from_frame(keys))
+        unique_codes = np.empty(len(uniques), dtype=np.int8)
+        for i, values in enumerate(uniques):
+            entry = dict(zip(key_cols, values))
+            account_class = overrides.get(entry.get('account')) or overrides.get(entry.get('account_name'))
+            unique_codes[i] = ACCOUNT_CLASSES.index(account_class or classify_account(**entry))
+        codes = unique_codes[row_codes]
+    gl_txn['account_class'] = pd.Categorical.from_codes(codes, categories=ACCOUNT_CLASSES)
+    return gl_txn
+
+
+def load_classified_gl(data_folder):
+    """GL transactions with parsed dates and account_class, cached per data version.
+
+    The returned frame is shared between requests and must not be mutated.
+    """
+    version = data_version(data_folder, GL_STEMS)
+
+    def compute():
+        gl_txn, _ = read_table(data_folder, "gl_txn")
+        if gl_txn is None:
+            return None
+        gl_txn = ensure_dates(gl_txn, GL_DATE_COLUMNS)
+        return classify_gl(gl_txn, _load_overrides(data_folder))
+
+    return analytics_cache.get_or_compute("classified_gl", version, compute, key=(data_folder,))
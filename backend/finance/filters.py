@@ -0,0 +1,89 @@
+"""
+Filter options for the finance dashboards, precomputed once per data version.
+
+sales_flat is reduced to a country x channel x status co-occurrence index:
+one cell per combination that occurs, with its row count. The distinct
+values of each filter and the options still valid under a selection are
+answered from those cells, so their cost depends on the number of
+combinations rather than on the size of the table.
+"""
+from core.lazy import lazy_import
+from core.cache import analytics_cache, data_version
+from core.utils import read_table
+
+np = lazy_import('numpy')
+
+# Filter parameter -> sales_flat column
+FILTER_COLUMNS = {"countries": "country", "channels": "channel_name", "statuses": "status"}
+
+
+class FilterIndex:
+    """Co-occurrence counts of filter values over the rows of a table"""
+
+    def __init__(self, values, codes, rows):
+        self.values = values  # Filter -> sorted distinct values
+        self.codes = codes  # Filter -> value position per cell, -1 for missing
+        self.rows = rows  # Row count per cell
+
+    @classmethod
+    def build(cls, df, columns=FILTER_COLUMNS):
+        present = {name: col for name, col in columns.items() if df is not None and col in df.columns}
+        if not present:
+            return cls({}, {}, np.zeros(0, dtype=np.int64))
+        cells = df.groupby(list(present.values()), dropna=False, observed=True).size().reset_index(name='rows')
+        values, codes = {}, {}
+        for name, col in present.items():
+            distinct = sorted(cells[col].dropna().unique().tolist())
+            values[name] = distinct
+            positions = {value: i for i, value in enumerate(distinct)}
+            codes[name] = np.array([positions.get(value, -1) for value in cells[col]], dtype=np.int64)
+        return cls(values, codes, cells['rows'].to_numpy(dtype=np.int64))
+
+    def _mask(self, name, selected):
+        positions = {value: i for i, value in enumerate(self.values[name])}
+        wanted = [positions[value] for value in selected if value in positions]
+        return np.isin(self.codes[name], wanted)
+
+    def cascade(self, selection):
+        """Options of every filter valid under the selections of the others, with row counts.
+
+        selection maps a filter name to its selected values; an empty or
+        missing list means no restriction. Returns (options, rows) where
+        options maps each filter to [{"value", "rows"}] and rows is the
+        number of rows matching the whole selection.
+        """
+        masks = {name: self._mask(name, selection[name]) for name in self.values if selection.get(name)}
+        everything = np.ones(len(self.rows), dtype=bool)
+        options = {}
+        for name, distinct in self.values.items():
+            # A filter's own selection does not narrow its options, so the user can still widen it
+            mask = everything.copy()
+            for other, other_mask in masks.items():
+                if other != name:
+                    mask &= other_mask
+            mask &= self.codes[name] >= 0
+            counts = np.bincount(self.codes[name][mask], weights=self.rows[mask], minlength=len(distinct))
+            options[name] = [
+                {"value": value, "rows": int(count)} for value, count in zip(distinct, counts) if count > 0
+            ]
+        matched = everything
+        for mask in masks.values():
+            matched = matched & mask
+        return options, int(self.rows[matched].sum())
+
+
+def load_filter_index(data_folder):
+    """FilterIndex of sales_flat plus fallback countries from ar_invoices, once per data version"""
+    version = data_version(data_folder, ("sales_flat", "ar_invoices"))
+
+    def compute():
+        sales_flat, _ = read_table(data_folder, "sales_flat")
+        index = FilterIndex.build(sales_flat)
+        fallback_countries = []
+        if not index.values.get("countries"):
+            ar_invoices, _ = read_table(data_folder, "ar_invoices")
+            if ar_invoices is not None and 'customer_country' in ar_invoices.columns:
+                fallback_countries = sorted(ar_invoices['customer_country'].dropna().unique().tolist())
+        return index, fallback_countries
+
+    return analytics_cache.get_or_compute("filter_index", version, compute, key=(data_folder,))
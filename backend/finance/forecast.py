@@ -0,0 +1,122 @@
+"""
+Batched revenue forecasting over all country x channel x category series.
+
+Every monthly series is a row of one 2-D array, so each model runs as a
+single loop over time with all series (and all smoothing parameters of the
+grid) updated together. Per series, the model with the lowest in-sample
+one-step error wins: Holt's linear exponential smoothing or seasonal naive.
+"""
+import hashlib
+from statistics import NormalDist
+from core.lazy import lazy_import
+from core.cache import analytics_cache, data_version
+from core.utils import read_table, ensure_dates
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+SERIES_DIMENSIONS = ['country', 'channel_name', 'category']
+SEASON = 12
+ALPHAS = (0.1, 0.3, 0.5, 0.8)
+BETAS = (0.0, 0.1, 0.2)
+
+
+def monthly_matrix(sales_flat):
+    """Revenue per series (rows) and month (columns), zero-filled"""
+    dims = [col for col in SERIES_DIMENSIONS if col in sales_flat.columns]
+    date_col = 'order_date' if 'order_date' in sales_flat.columns else 'order_month'
+    sales_flat = ensure_dates(sales_flat.copy(), [date_col]).dropna(subset=[date_col])
+    month = sales_flat[date_col].dt.to_period('M').rename('month')
+    # Without any dimension there is one series, labelled like working_capital_series' single cell
+    keys = [sales_flat[col].fillna('Unknown').astype(str) for col in dims] \
+        or [pd.Series('All', index=sales_flat.index, name='total')]
+    matrix = sales_flat.groupby(keys + [month])['extended_price'].sum().unstack('month', fill_value=0.0)
+    months = pd.period_range(matrix.columns.min(), matrix.columns.max(), freq='M')
+    return matrix.reindex(columns=months, fill_value=0.0)
+
+
+def _holt(y):
+    """One-step errors and final level/trend for every (alpha, beta) over all series.
+
+    y has shape (series, T); results have a leading grid axis of len(ALPHAS) * len(BETAS).
+    """
+    alpha = np.repeat(np.array(ALPHAS), len(BETAS))[:, None]
+    beta = np.tile(np.array(BETAS), len(ALPHAS))[:, None]
+    level = np.broadcast_to(y[:, 0], (len(alpha), y.shape[0])).copy()
+    trend = np.broadcast_to(y[:, 1] - y[:, 0], level.shape).copy()
+    errors = np.zeros((len(alpha),) + y.shape)
+    for t in range(1, y.shape[1]):
+        forecast = level + trend
+        errors[:, :, t] = y[:, t] - forecast
+        new_level = alpha * y[:, t] + (1 - alpha) * forecast
+        trend = beta * (new_level - level) + (1 - beta) * trend
+        level = new_level
+    return errors, level, trend, alpha[:, 0]
+
+
+def forecast_matrix(y, horizon=6, level=0.9):
+    """Point forecasts and symmetric intervals for every row of y.
+
+    Returns (forecast, lower, upper, model, half_width) with forecasts shaped
+    (series, horizon). half_width is the unclipped interval half-width, for
+    combining intervals across series; lower is clipped at zero.
+    """
+    n_series, n_months = y.shape
+    steps = np.arange(1, horizon + 1)
+    z = NormalDist().inv_cdf(0.5 + level / 2)
+
+    if n_months < 3:
+        # Too short to fit anything: carry the last value forward
+        point = np.repeat(y[:, -1:], horizon, axis=1)
+        return point, point, point, np.array(["naive"] * n_series), np.zeros_like(point)
+
+    errors, final_level, final_trend, alphas = _holt(y)
+    start = SEASON if n_months >= 2 * SEASON else 2
+    sse = (errors[:, :, start:] ** 2).sum(axis=2)
+    best = sse.argmin(axis=0)
+    rows = np.arange(n_series)
+    holt_point = final_level[best, rows][:, None] + final_trend[best, rows][:, None] * steps
+    holt_sigma = np.sqrt(sse[best, rows] / (n_months - start))
+    holt_spread = holt_sigma[:, None] * np.sqrt(1 + (steps - 1) * alphas[best][:, None] ** 2)
+
+    point, spread, model = holt_point, holt_spread, np.array(["holt"] * n_series)
+    if n_months >= 2 * SEASON:
+        seasonal_errors = y[:, start:] - y[:, start - SEASON:n_months - SEASON]
+        seasonal_sse = (seasonal_errors ** 2).sum(axis=1)
+        seasonal_point = y[:, n_months - SEASON + (steps - 1) % SEASON]
+        seasonal_sigma = np.sqrt(seasonal_sse / (n_months - start))
+        seasonal_spread = seasonal_sigma[:, None] * np.sqrt((steps - 1) // SEASON + 1)
+        use_seasonal = seasonal_sse < sse[best, rows]
+        point = np.where(use_seasonal[:, None], seasonal_point, holt_point)
+        spread = np.where(use_seasonal[:, None], seasonal_spread, holt_spread)
+        model = np.where(use_seasonal, "seasonal_naive", "holt")
+
+    point = np.clip(point, 0, None)  # Revenue cannot go negative
+    half_width = z * spread
+    return point, np.clip(point - half_width, 0, None), point + half_width, model, half_width
+
+
+def load_forecast(data_folder, horizon=6, level=0.9):
+    """Forecast for every series, refitted only when the monthly aggregates change"""
+    version = data_version(data_folder, ("sales_flat",))
+
+    def compute_matrix():
+        sales_flat, _ = read_table(data_folder, "sales_flat")
+        if sales_flat is None or 'extended_price' not in sales_flat.columns:
+            return None
+        return monthly_matrix(sales_flat)
+
+    matrix = analytics_cache.get_or_compute("forecast_monthly_matrix", version, compute_matrix, key=(data_folder,))
+    if matrix is None:
+        return None, None
+
+    # Key the fit on the aggregates themselves so unrelated file changes don't refit
+    digest = hashlib.sha1(matrix.to_numpy().tobytes())
+    digest.update(repr((list(matrix.index), str(matrix.columns[0]), len(matrix.columns))).encode())
+    aggregates_version = digest.hexdigest()[:12]
+
+    def compute_forecast():
+        return forecast_matrix(matrix.to_numpy(dtype=float), horizon=horizon, level=level)
+
+    result = analytics_cache.get_or_compute("forecast", aggregates_version, compute_forecast, key=(horizon, level))
+    return matrix, result
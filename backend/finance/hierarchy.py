@@ -0,0 +1,92 @@
+"""
+Prefix-summed rollup tree over the chart-of-accounts hierarchy.
+
+Leaves (one per distinct category / account / cost-centre path) are sorted so
+every node owns a contiguous leaf range. Amounts are stored as a 2-D prefix
+sum over leaves x months, which makes any node's total for any month range
+four array lookups, and a children breakdown proportional to the number of
+children rather than the number of GL rows.
+"""
+from core.lazy import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+UNASSIGNED = "Unassigned"
+
+
+class RollupTree:
+    """Hierarchical totals for a frame, queryable by node path and month range"""
+
+    def __init__(self, frame, levels, date_col=None, value_col='amount'):
+        self.levels = list(levels)
+        keys = frame[self.levels].astype(object).fillna(UNASSIGNED).astype(str)
+
+        # Column 0 holds undated rows; they only count when no period is requested
+        self.months = pd.PeriodIndex([], freq='M')
+        month_pos = np.zeros(len(frame), dtype=int)
+        if date_col and date_col in frame.columns:
+            month = frame[date_col].dt.to_period('M')
+            dated = month.notna().to_numpy()
+            if dated.any():
+                self.months = pd.period_range(month.min(), month.max(), freq='M')
+                month_pos[dated] = self.months.searchsorted(month[dated]) + 1
+
+        leaf_codes, leaves = pd.factorize(pd.MultiIndex.from_frame(keys), sort=True)
+        self.leaves = list(leaves)
+        width = len(self.months) + 1
+        matrix = np.bincount(
+            leaf_codes * width + month_pos,
+            weights=frame[value_col].fillna(0).to_numpy(dtype=float),
+            minlength=len(self.leaves) * width,
+        ).reshape(len(self.leaves), width)
+
+        self._prefix = np.zeros((len(self.leaves) + 1, len(self.months) + 2))
+        self._prefix[1:, 1:] = matrix.cumsum(axis=0).cumsum(axis=1)
+
+        # Node path -> [first leaf, last leaf + 1] and ordered children labels
+        self._ranges = {(): [0, len(self.leaves)]}
+        self._children = {(): []}
+        for i, leaf in enumerate(self.leaves):
+            for depth in range(1, len(leaf) + 1):
+                path = tuple(leaf[:depth])
+                if path not in self._ranges:
+                    self._ranges[path] = [i, i + 1]
+                    self._children[path] = []
+                    self._children[path[:-1]].append(path[-1])
+                else:
+                    self._ranges[path][1] = i + 1
+
+    def __contains__(self, path):
+        return tuple(path) in self._ranges
+
+    def _month_bounds(self, date_start=None, date_end=None):
+        if not date_start and not date_end:
+            return 0, len(self.months) + 1
+        first = self.months.searchsorted(pd.Period(date_start, 'M')) if date_start else 0
+        last = self.months.searchsorted(pd.Period(date_end, 'M'), side='right') if date_end else len(self.months)
+        return first + 1, max(last + 1, first + 1)
+
+    def _range_sum(self, path, bounds):
+        lo, hi = self._ranges[path]
+        c0, c1 = bounds
+        p = self._prefix
+        # Currency amounts: round away the cancellation noise of the prefix differences
+        return round(float(p[hi, c1] - p[lo, c1] - p[hi, c0] + p[lo, c0]), 2)
+
+    def total(self, path=(), date_start=None, date_end=None):
+        """Total of a node over the (month-granular) period"""
+        return self._range_sum(tuple(path), self._month_bounds(date_start, date_end))
+
+    def children(self, path=(), date_start=None, date_end=None):
+        """Breakdown of a node into its direct children over the period"""
+        path = tuple(path)
+        bounds = self._month_bounds(date_start, date_end)
+        return [
+            {
+                "label": label,
+                "value": self._range_sum(path + (label,), bounds),
+                "has_children": len(path) + 1 < len(self.levels),
+            }
+            for label in self._children[path]
+        ]
@@ -0,0 +1,340 @@
+"""
+Concurrent load test that replays the finance dashboard's request fan-out.
+
+Each virtual user repeatedly "opens the dashboard": it picks a random filter
+combination and fetches every panel the frontend loads for that page, a few
+requests at a time like a browser. Latency, status codes and the server's
+RSS are recorded and written as a JSON report that later runs can be
+compared against.
+
+    python manage.py loadtest --serve --generate /tmp/bi-load --users 20 --duration 60 --output run.json
+    python manage.py loadtest --url http://127.0.0.1:8000 --pid 4242 --compare run.json
+"""
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Panels the finance page requests on load and on every filter change (frontend/src/lib/api.ts)
+FILTERED_ENDPOINTS = [
+    "/api/finance/dashboard/",
+    "/api/finance/charts/revenue/",
+    "/api/finance/charts/expenses/",
+    "/api/finance/data/monthly/",
+    "/api/finance/data/cashflow/",
+    "/api/finance/data/aging/",
+    "/api/finance/data/bridge/",
+    "/api/finance/invoices/ar/",
+    "/api/finance/invoices/ap/",
+    "/api/finance/metrics/working-capital/",
+]
+FILTERS_ENDPOINT = "/api/finance/filters/"
+COMMENTARY_ENDPOINT = "/api/finance/analytics/commentary/"
+PERCENTILES = (50, 90, 95, 99)
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return None
+    rank = max(int(round(pct / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def latency_summary(latencies_ms):
+    values = sorted(latencies_ms)
+    summary = {f"p{p}": round(percentile(values, p), 1) if values else None for p in PERCENTILES}
+    summary["mean"] = round(sum(values) / len(values), 1) if values else None
+    summary["max"] = round(values[-1], 1) if values else None
+    return summary
+
+
+def process_rss_mb(pid):
+    """Resident memory of a process and its descendants, or None where /proc is unavailable"""
+    def rss_kb(p):
+        try:
+            with open(f"/proc/{p}/status") as fh:
+                for line in fh:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        return 0
+
+    def children(p):
+        kids = []
+        try:
+            for task in os.listdir(f"/proc/{p}/task"):
+                with open(f"/proc/{p}/task/{task}/children") as fh:
+                    kids.extend(int(c) for c in fh.read().split())
+        except OSError:
+            pass
+        return kids
+
+    if not os.path.exists(f"/proc/{pid}"):
+        return None
+    total, stack = 0, [pid]
+    while stack:
+        p = stack.pop()
+        total += rss_kb(p)
+        stack.extend(children(p))
+    return round(total / 1024, 1)
+
+
+class Recorder:
+    """Thread-safe log of every request made during the run"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.samples = []  # (seconds since start, endpoint, status, latency ms, bytes)
+        self._lock = threading.Lock()
+
+    def add(self, endpoint, status, latency_ms, size):
+        with self._lock:
+            self.samples.append((time.perf_counter() - self.started, endpoint, status, latency_ms, size))
+
+
+class Command(BaseCommand):
+    help = "Replay the finance dashboard's endpoint fan-out at a target concurrency and report latency"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8000", help="Base URL of a running server")
+        parser.add_argument("--users", type=int, default=10, help="Concurrent virtual users")
+        parser.add_argument("--duration", type=float, default=30.0, help="Seconds to generate load for")
+        parser.add_argument("--connections", type=int, default=6, help="Parallel requests per user, like a browser")
+        parser.add_argument("--think", type=float, default=0.0, help="Seconds a user waits between page loads")
+        parser.add_argument("--timeout", type=float, default=30.0, help="Per-request timeout in seconds")
+        parser.add_argument("--with-commentary", action="store_true", help="Include the LLM commentary panel")
+        parser.add_argument("--date-min", default="2023-01-01", help="Earliest date used for random date filters")
+        parser.add_argument("--date-max", default="2025-06-30", help="Latest date used for random date filters")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--generate", metavar="DIR", help="Write a synthetic dataset to DIR first")
+        parser.add_argument("--rows", type=int, default=200_000, help="Sales rows in the synthetic dataset")
+        parser.add_argument("--serve", action="store_true",
+                            help="Start a local runserver on a free port (on --generate's data if given)")
+        parser.add_argument("--pid", type=int, help="Server process to sample RSS from (implied by --serve)")
+        parser.add_argument("--sample-interval", type=float, default=1.0, help="Seconds between RSS samples")
+        parser.add_argument("--output", help="Write the JSON report here")
+        parser.add_argument("--compare", metavar="REPORT", help="Compare against a previously saved report")
+
+    def handle(self, *args, **options):
+        if options["generate"]:
+            from finance.synthetic import generate_dataset
+            self.stdout.write(f"Generating {options['rows']:,} synthetic sales rows in {options['generate']}")
+            generate_dataset(options["generate"], rows=options["rows"], start=options["date_min"],
+                             end=options["date_max"], seed=options["seed"])
+
+        server = None
+        if options["serve"]:
+            server, options["url"] = self.start_server(options["generate"] or settings.DATA_FOLDER)
+            options["pid"] = server.pid
+        try:
+            report = self.run_load(options)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=10)
+
+        self.print_report(report)
+        if options["output"]:
+            with open(options["output"], "w") as fh:
+                json.dump(report, fh, indent=2)
+            self.stdout.write(f"Report written to {options['output']}")
+        if options["compare"]:
+            with open(options["compare"]) as fh:
+                self.print_comparison(json.load(fh), report)
+
+    # -- server ---------------------------------------------------------------
+
+    def start_server(self, data_folder):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        env = dict(os.environ, BI_DATA_FOLDER=data_folder)
+        manage = os.path.join(settings.BASE_DIR, "manage.py")
+        server = subprocess.Popen(
+            [sys.executable, manage, "runserver", f"127.0.0.1:{port}", "--noreload"],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        url = f"http://127.0.0.1:{port}"
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError("Test server exited during startup")
+            try:
+                urllib.request.urlopen(url + FILTERS_ENDPOINT, timeout=5).read()
+                self.stdout.write(f"Serving {data_folder} at {url} (pid {server.pid})")
+                return server, url
+            except (urllib.error.URLError, OSError):
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError("Test server did not start within 60s")
+
+    # -- load -----------------------------------------------------------------
+
+    def fetch(self, base_url, endpoint, params, timeout, recorder):
+        url = base_url + endpoint + ("?" + urllib.parse.urlencode(params, doseq=True) if params else "")
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as response:
+                body = response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            body, status = e.read(), e.code
+        except (urllib.error.URLError, OSError):
+            body, status = b"", 0  # Connection refused, reset or timed out
+        recorder.add(endpoint, status, (time.perf_counter() - start) * 1000, len(body))
+        return status, body
+
+    def random_filters(self, rng, options, choices):
+        params = {}
+        for key, probability in (("countries", 0.5), ("channels", 0.4), ("statuses", 0.2)):
+            values = choices.get(key) or []
+            if values and rng.random() < probability:
+                params[key] = rng.sample(values, rng.randint(1, min(3, len(values))))
+        if rng.random() < 0.5:
+            first = date.fromisoformat(options["date_min"])
+            last = date.fromisoformat(options["date_max"])
+            start = first + timedelta(days=rng.randint(0, max((last - first).days - 30, 0)))
+            end = min(start + timedelta(days=rng.choice((30, 90, 180, 365))), last)
+            params["date_start"], params["date_end"] = start.isoformat(), end.isoformat()
+        return params
+
+    def virtual_user(self, user, deadline, options, choices, recorder):
+        rng = random.Random(options["seed"] * 1000 + user)
+        endpoints = FILTERED_ENDPOINTS + ([COMMENTARY_ENDPOINT] if options["with_commentary"] else [])
+        with ThreadPoolExecutor(max_workers=options["connections"]) as browser:
+            while time.perf_counter() < deadline:
+                params = self.random_filters(rng, options, choices)
+                list(browser.map(
+                    lambda endpoint: self.fetch(options["url"], endpoint, params, options["timeout"], recorder),
+                    endpoints,
+                ))
+                if options["think"]:
+                    time.sleep(options["think"])
+
+    def run_load(self, options):
+        recorder = Recorder()
+        status, body = self.fetch(options["url"], FILTERS_ENDPOINT, {}, options["timeout"], recorder)
+        if status != 200:
+            raise CommandError(f"{options['url']}{FILTERS_ENDPOINT} returned {status or 'no response'}")
+        choices = json.loads(body)
+
+        rss, stop = [], threading.Event()
+
+        def sample_rss():
+            while not stop.is_set():
+                mb = process_rss_mb(options["pid"])
+                if mb is not None:
+                    rss.append([round(time.perf_counter() - recorder.started, 1), mb])
+                stop.wait(options["sample_interval"])
+
+        sampler = threading.Thread(target=sample_rss, daemon=True) if options["pid"] else None
+        if sampler:
+            sampler.start()
+
+        self.stdout.write(f"Running {options['users']} users for {options['duration']:.0f}s against {options['url']}")
+        started_at = datetime.now().isoformat(timespec="seconds")
+        deadline = time.perf_counter() + options["duration"]
+        with ThreadPoolExecutor(max_workers=options["users"]) as users:
+            for user in range(options["users"]):
+                users.submit(self.virtual_user, user, deadline, options, choices, recorder)
+        elapsed = time.perf_counter() - recorder.started
+        stop.set()
+        if sampler:
+            sampler.join()
+        return self.build_report(recorder.samples, elapsed, rss, options, started_at)
+
+    # -- reporting ------------------------------------------------------------
+
+    def build_report(self, samples, elapsed, rss, options, started_at):
+        def stats(rows):
+            errors = sum(1 for _, _, status, _, _ in rows if status == 0 or status >= 400)
+            statuses = {}
+            for _, _, status, _, _ in rows:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+            return {
+                "requests": len(rows),
+                "errors": errors,
+                "error_rate": round(errors / len(rows), 4) if rows else 0.0,
+                "throughput_rps": round(len(rows) / elapsed, 2) if elapsed else 0.0,
+                "latency_ms": latency_summary([latency for _, _, _, latency, _ in rows]),
+                "statuses": statuses,
+                "bytes": sum(size for _, _, _, _, size in rows),
+            }
+
+        by_endpoint = {}
+        for row in samples:
+            by_endpoint.setdefault(row[1], []).append(row)
+        timeline = []
+        for second in range(int(elapsed) + 1):
+            rows = [row for row in samples if second <= row[0] < second + 1]
+            if rows:
+                timeline.append({"t": second, **{k: v for k, v in stats(rows).items() if k != "throughput_rps"}})
+        return {
+            "meta": {
+                "started_at": started_at,
+                "url": options["url"],
+                "users": options["users"],
+                "connections_per_user": options["connections"],
+                "duration_s": round(elapsed, 1),
+                "seed": options["seed"],
+                "synthetic_rows": options["rows"] if options["generate"] else None,
+            },
+            "summary": stats(samples),
+            "endpoints": {endpoint: stats(rows) for endpoint, rows in sorted(by_endpoint.items())},
+            "timeline": timeline,
+            "rss_mb": rss,
+        }
+
+    def print_report(self, report):
+        summary = report["summary"]
+        latency = summary["latency_ms"]
+        self.stdout.write(
+            f"\n{summary['requests']} requests in {report['meta']['duration_s']}s: "
+            f"{summary['throughput_rps']} req/s, error rate {summary['error_rate']:.2%}"
+        )
+        self.stdout.write("latency ms: " + ", ".join(f"{k} {v}" for k, v in latency.items()))
+        if report["rss_mb"]:
+            peak = max(mb for _, mb in report["rss_mb"])
+            self.stdout.write(f"server RSS: start {report['rss_mb'][0][1]} MB, peak {peak} MB, "
+                              f"end {report['rss_mb'][-1][1]} MB")
+        self.stdout.write(f"\n{'endpoint':45} {'reqs':>6} {'err%':>6} {'p50':>8} {'p95':>8} {'p99':>8}")
+        for endpoint, stats in report["endpoints"].items():
+            lat = stats["latency_ms"]
+            self.stdout.write(f"{endpoint:45} {stats['requests']:>6} {stats['error_rate']:>6.1%} "
+                              f"{lat['p50'] or 0:>8} {lat['p95'] or 0:>8} {lat['p99'] or 0:>8}")
+
+    def print_comparison(self, baseline, report):
+        def change(old, new):
+            if old in (None, 0) or new is None:
+                return "n/a"
+            return f"{(new - old) / old:+.1%}"
+
+        self.stdout.write(f"\nCompared with the run of {baseline['meta'].get('started_at')}:")
+        rows = [("throughput_rps", baseline["summary"]["throughput_rps"], report["summary"]["throughput_rps"]),
+                ("error_rate", baseline["summary"]["error_rate"], report["summary"]["error_rate"])]
+        rows += [(f"latency {k}", baseline["summary"]["latency_ms"].get(k), v)
+                 for k, v in report["summary"]["latency_ms"].items()]
+        old_rss = [mb for _, mb in baseline.get("rss_mb") or []]
+        new_rss = [mb for _, mb in report.get("rss_mb") or []]
+        if old_rss and new_rss:
+            rows.append(("peak RSS MB", max(old_rss), max(new_rss)))
+        for name, old, new in rows:
+            self.stdout.write(f"  {name:18} {old!s:>10} -> {new!s:>10}  {change(old, new)}")
+        self.stdout.write(f"\n{'endpoint p95 ms':45} {'before':>8} {'after':>8} {'change':>8}")
+        for endpoint, stats in report["endpoints"].items():
+            old = baseline["endpoints"].get(endpoint, {}).get("latency_ms", {}).get("p95")
+            new = stats["latency_ms"]["p95"]
+            self.stdout.write(f"{endpoint:45} {old!s:>8} {new!s:>8} {change(old, new):>8}")
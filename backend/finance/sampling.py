@@ -0,0 +1,158 @@
+"""
+Stratified sample of sales_flat for approximate answers with error bounds.
+
+Rows are stratified by country x channel x order month and sampled without
+replacement within each stratum; strata too small to sample reliably are
+kept whole and so contribute exactly. Sums and counts are scaled back up
+with the stratified (Horvitz-Thompson) estimator and returned with a normal
+confidence interval. The sample is rebuilt once per data version.
+"""
+import hashlib
+from statistics import NormalDist
+from core.lazy import lazy_import
+from django.conf import settings
+from core.cache import analytics_cache, data_version
+from core.utils import read_table, ensure_dates
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+STRATA_COLUMNS = ['country', 'channel_name']
+STRATUM = '__stratum'
+
+
+def _setting(name, default):
+    return getattr(settings, 'APPROX_QUERY', {}).get(name, default)
+
+
+def _date_column(df):
+    return 'order_date' if 'order_date' in df.columns else 'order_month' if 'order_month' in df.columns else None
+
+
+class StratifiedSample:
+    """Sampled rows plus the population and sample size of every stratum"""
+
+    def __init__(self, rows, population, sampled):
+        self.rows = rows
+        self.population = population  # Rows per stratum in the full table
+        self.sampled = sampled  # Rows per stratum kept in the sample
+
+    @classmethod
+    def build(cls, sales_flat, fraction=0.01, min_rows=200, seed=0):
+        date_col = _date_column(sales_flat)
+        keys = [sales_flat[col].fillna('Unknown').astype(str) for col in STRATA_COLUMNS if col in sales_flat.columns]
+        if date_col:
+            dates = pd.to_datetime(sales_flat[date_col], errors='coerce')
+            keys.append(dates.dt.to_period('M').astype(str))
+        if not keys:
+            keys = [pd.Series('All', index=sales_flat.index)]
+        codes = sales_flat.groupby(keys, sort=False, dropna=False).ngroup().to_numpy()
+
+        population = np.bincount(codes)
+        # Small strata are kept whole; the rest keep at least min_rows rows
+        sampled = np.where(
+            population <= min_rows, population,
+            np.minimum(population, np.maximum(min_rows, np.ceil(population * fraction))).astype(int),
+        )
+        rank = pd.Series(np.random.default_rng(seed).random(len(codes))).groupby(codes).rank(method='first')
+        keep = rank.to_numpy() <= sampled[codes]
+
+        rows = ensure_dates(sales_flat[keep].copy(), ['order_date', 'order_month'])
+        rows[STRATUM] = codes[keep]
+        return cls(rows, population, sampled)
+
+    def estimate(self, selected, column=None, by=None, level=0.95):
+        """Estimated sum of column (row count when None) over the selected sample rows.
+
+        selected is a filtered subset of self.rows; by optionally groups the
+        estimate. Returns a frame with estimate, ci (half-width at the given
+        confidence level) and exact (no sampled stratum contributed).
+        """
+        values = selected[column].fillna(0).astype(float) if column else pd.Series(1.0, index=selected.index)
+        frame = pd.DataFrame({STRATUM: selected[STRATUM], "y": values, "y2": values ** 2})
+        keys = [STRATUM] + ([by] if by is not None else [])
+        if by is not None:
+            frame[by] = selected[by]
+        cells = frame.groupby(keys, observed=True, dropna=False)[["y", "y2"]].sum().reset_index()
+
+        N = self.population[cells[STRATUM]].astype(float)
+        n = self.sampled[cells[STRATUM]].astype(float)
+        weight = N / n
+        # Within-stratum variance of y (zero for unselected rows), with finite population correction
+        s2 = (cells["y2"] - cells["y"] ** 2 / n) / np.maximum(n - 1, 1)
+        cells["estimate"] = weight * cells["y"]
+        cells["variance"] = np.where(n < N, N ** 2 * (1 - n / N) * s2 / n, 0.0)
+        cells["exact"] = n >= N
+
+        if by is not None:
+            result = cells.groupby(by, dropna=False).agg(
+                estimate=("estimate", "sum"), variance=("variance", "sum"), exact=("exact", "all")
+            ).reset_index()
+        else:
+            result = pd.DataFrame([{
+                "estimate": cells["estimate"].sum(), "variance": cells["variance"].sum(),
+                "exact": bool(cells["exact"].all()),
+            }])
+        z = NormalDist().inv_cdf(0.5 + level / 2)
+        result["ci"] = z * np.sqrt(result.pop("variance").clip(lower=0))
+        return result
+
+
+def load_sales_sample(data_folder):
+    """Stratified sample of sales_flat, rebuilt only when the data changes"""
+    version = data_version(data_folder, ("sales_flat",))
+    fraction = _setting('SAMPLE_FRACTION', 0.01)
+    min_rows = _setting('MIN_STRATUM_ROWS', 200)
+
+    def compute():
+        sales_flat, _ = read_table(data_folder, "sales_flat")
+        if sales_flat is None:
+            return None
+        # Seed from the version so every worker draws the same sample
+        seed = int(hashlib.sha1(version.encode()).hexdigest()[:8], 16)
+        return StratifiedSample.build(sales_flat, fraction=fraction, min_rows=min_rows, seed=seed)
+
+    return analytics_cache.get_or_compute("sales_sample", version, compute, key=(data_folder, fraction, min_rows))
+
+
+def sample_totals(data_folder, measures, filter_fn=None, filter_kwargs=None, by=None, level=None):
+    """Approximate sums/counts of sales_flat from the stratified sample.
+
+    measures maps an output name to (column, agg) with agg sum or count, as
+    for core.parallel.aggregate_partitions. Returns None if the dataset is
+    missing, else a dict with the estimates, their confidence intervals and
+    sample details.
+    """
+    sample = load_sales_sample(data_folder)
+    if sample is None:
+        return None
+    level = level or _setting('CONFIDENCE', 0.95)
+    selected = sample.rows
+    if filter_fn is not None:
+        selected = filter_fn(selected, **(filter_kwargs or {}))
+    if by is not None and by not in selected.columns:
+        return None
+
+    estimates, intervals, exact = {}, {}, True
+    for name, (column, agg) in measures.items():
+        if agg not in ("sum", "count"):
+            raise ValueError(f"Approximate mode supports sum and count, not {agg}")
+        if column is not None and column not in selected.columns:
+            estimates[name] = intervals[name] = None
+            continue
+        estimate = sample.estimate(selected, column if agg == "sum" else None, by=by, level=level)
+        if by is not None:
+            estimate = estimate.set_index(by)
+            estimates[name], intervals[name] = estimate["estimate"], estimate["ci"]
+        else:
+            estimates[name], intervals[name] = float(estimate["estimate"].iloc[0]), float(estimate["ci"].iloc[0])
+        exact = exact and bool(estimate["exact"].all())
+
+    return {
+        "result": pd.DataFrame(estimates) if by is not None else pd.DataFrame([estimates]),
+        "ci": pd.DataFrame(intervals) if by is not None else pd.DataFrame([intervals]),
+        "level": level,
+        "exact": exact,
+        "sample_rows": len(sample.rows),
+        "population_rows": int(sample.population.sum()),
+    }
@@ -0,0 +1,116 @@
+"""
+Synthetic finance datasets for load testing and local development.
+
+Writes the same stems and columns the finance views read (sales_flat,
+ar_invoices, ar_receipts, ap_invoices, gl_txn, budget, inventory), with
+realistic-looking distributions and a fixed seed so runs are comparable.
+"""
+import os
+from core.lazy import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+COUNTRIES = ['UAE', 'KSA', 'Qatar', 'Kuwait', 'Bahrain', 'Oman']
+CHANNELS = ['HORECA', 'Retail', 'Export', 'Chemical', 'Pharma']
+CATEGORIES = ['FMCG-Food', 'FMCG-Non-Food', 'Chemical', 'Pharma']
+STATUSES = ['Delivered', 'Pending', 'In Transit', 'Cancelled']
+GL_ACCOUNTS = [
+    ('4000 Sales Revenue', 'Revenue'), ('4100 Other Income', 'Revenue'),
+    ('5000 Cost of Goods Sold', 'Expense'), ('6100 Salaries', 'Expense'), ('6200 Rent', 'Expense'),
+    ('6300 Marketing', 'Expense'), ('6400 Utilities', 'Expense'), ('1100 Cash', 'Asset'),
+]
+COST_CENTERS = ['CC-DXB', 'CC-RUH', 'CC-DOH', 'CC-KWI']
+
+
+def generate_dataset(folder, rows=200_000, start='2023-01-01', end='2025-06-30', seed=0):
+    """Write a synthetic dataset with `rows` sales lines to folder; returns the files written"""
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    days = pd.date_range(start, end)
+    tables = {}
+
+    order_date = days[rng.integers(0, len(days), rows)]
+    quantity = rng.integers(1, 50, rows)
+    unit_price = rng.lognormal(3.2, 0.6, rows).round(2)
+    tables["sales_flat"] = pd.DataFrame({
+        "order_id": np.arange(rows),
+        "order_date": order_date,
+        "order_month": order_date.to_period('M').to_timestamp(),
+        "country": rng.choice(COUNTRIES, rows, p=[0.35, 0.25, 0.12, 0.1, 0.08, 0.1]),
+        "channel_name": rng.choice(CHANNELS, rows),
+        "category": rng.choice(CATEGORIES, rows),
+        "status": rng.choice(STATUSES, rows, p=[0.7, 0.12, 0.13, 0.05]),
+        "customer_id": rng.zipf(1.3, rows) % 5000,
+        "quantity": quantity,
+        "unit_price": unit_price,
+        "extended_price": (quantity * unit_price).round(2),
+        "delivery_date": order_date + pd.to_timedelta(rng.gamma(2.0, 2.5, rows).astype(int) + 1, unit='D'),
+    })
+
+    invoices = max(rows // 10, 1)
+    invoice_date = days[rng.integers(0, len(days), invoices)]
+    amount = rng.lognormal(9.5, 0.8, invoices).round(2)
+    paid = np.where(rng.random(invoices) < 0.7, amount, amount * rng.random(invoices)).round(2)
+    tables["ar_invoices"] = pd.DataFrame({
+        "invoice_id": [f"INV-{i}" for i in range(invoices)],
+        "customer_id": rng.integers(1, 5000, invoices),
+        "customer_name": [f"Customer {i}" for i in rng.integers(1, 5000, invoices)],
+        "customer_country": rng.choice(COUNTRIES, invoices),
+        "channel_name": rng.choice(CHANNELS, invoices),
+        "invoice_date": invoice_date,
+        "due_date": invoice_date + pd.Timedelta(days=30),
+        "amount": amount,
+        "paid_amount": paid,
+        "status": np.where(paid >= amount, "Paid", "Open"),
+    })
+    tables["ar_receipts"] = pd.DataFrame({
+        "invoice_id": tables["ar_invoices"]["invoice_id"],
+        "amount": paid,
+        "receipt_date": invoice_date + pd.to_timedelta(rng.integers(10, 90, invoices), unit='D'),
+    })
+    tables["ap_invoices"] = pd.DataFrame({
+        "invoice_id": [f"BILL-{i}" for i in range(invoices)],
+        "vendor_id": rng.integers(1, 300, invoices),
+        "vendor_name": [f"Vendor {i}" for i in rng.integers(1, 300, invoices)],
+        "invoice_date": invoice_date,
+        "due_date": invoice_date + pd.Timedelta(days=45),
+        "amount": (amount * 0.6).round(2),
+        "paid_amount": (paid * 0.6).round(2),
+    })
+
+    gl_rows = max(rows // 2, 1)
+    account = rng.integers(0, len(GL_ACCOUNTS), gl_rows)
+    sign = np.where([GL_ACCOUNTS[i][1] == 'Revenue' for i in account], 1.0, -1.0)
+    tables["gl_txn"] = pd.DataFrame({
+        "date": days[rng.integers(0, len(days), gl_rows)],
+        "account": [GL_ACCOUNTS[i][0] for i in account],
+        "account_name": [GL_ACCOUNTS[i][0][5:] for i in account],
+        "account_type": [GL_ACCOUNTS[i][1] for i in account],
+        "cost_center": rng.choice(COST_CENTERS, gl_rows),
+        "entity": rng.choice(COUNTRIES, gl_rows),
+        "amount": (rng.lognormal(7.5, 1.0, gl_rows) * sign).round(2),
+    })
+
+    months = pd.period_range(start, end, freq='M').to_timestamp()
+    budget = [
+        (month, account_class, country, rng.uniform(low, high))
+        for month in months for country in COUNTRIES
+        for account_class, low, high in (("revenue", 2e5, 4e5), ("cogs", 1e5, 2e5), ("opex", 5e4, 9e4))
+    ]
+    tables["budget"] = pd.DataFrame(budget, columns=["month", "account", "entity", "amount"]).round({"amount": 2})
+
+    skus = 500
+    tables["inventory"] = pd.DataFrame({
+        "sku": [f"SKU-{i}" for i in range(skus)],
+        "category": rng.choice(CATEGORIES, skus),
+        "cost_per_unit": rng.uniform(1, 50, skus).round(2),
+        "quantity_on_hand": rng.integers(0, 1000, skus),
+    })
+
+    paths = []
+    for stem, df in tables.items():
+        path = os.path.join(folder, f"{stem}.csv")
+        df.to_csv(path, index=False)
+        paths.append(path)
+    return paths
@@ -12,6 +12,8 @@ urlpatterns = [
     path('data/cashflow/', views.CashFlowDataView.as_view(), name='finance-cashflow-data'),
     path('data/aging/', views.AgingDataView.as_view(), name='finance-aging-data'),
     path('data/bridge/', views.BridgeDataView.as_view(), name='finance-bridge-data'),
+    path('data/variance/', views.VarianceView.as_view(), name='finance-variance-data'),
+    path('data/forecast/', views.ForecastView.as_view(), name='finance-forecast-data'),
     
     # Invoice data endpoints
     path('invoices/ar/', views.ARInvoicesView.as_view(), name='finance-ar-invoices'),
@@ -20,6 +22,9 @@ urlpatterns = [
     # Metrics endpoints
     path('metrics/working-capital/', views.WorkingCapitalMetricsView.as_view(), name='finance-working-capital-metrics'),
     
+    # Streaming export
+    path('export/<str:stem>/', views.ExportView.as_view(), name='finance-export'),
+    
     # Filters and configuration
     path('filters/', views.FiltersView.as_view(), name='finance-filters'),
     
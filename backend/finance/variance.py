@@ -0,0 +1,171 @@
+"""
+Budget-vs-actual variance engine at month x account x entity grain.
+
+Budget lines and actuals (revenue from sales_flat, everything else from the
+classified GL) are reduced to the same categorical keys and joined in a
+single merge. Accounts are GL accounts under their account class as a
+parent level. A budget set per class rather than per GL account (and one
+without an entity split) puts every line under "All" at that level, and
+actuals are reduced to the same level so they join. The joined frame is
+cached per data version and rolled up to whatever grain a caller asks for.
+"""
+from core.lazy import lazy_import
+from core.cache import analytics_cache, data_version
+from core.utils import read_table, ensure_dates
+from .accounts import ACCOUNT_CLASSES, ACCOUNT_MAP_STEM, EXPENSE_CLASSES, PNL_CLASSES, classify_account, load_classified_gl
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+VARIANCE_STEMS = ("budget", "sales_flat", "gl_txn", ACCOUNT_MAP_STEM)
+VARIANCE_KEYS = ["month", "account_class", "account", "entity"]
+ENTITY_COLUMNS = ['entity', 'company', 'country', 'customer_country']
+ALL_ENTITIES = "All"
+ALL_ACCOUNTS = "All"
+
+
+def _entity(df, use_entity):
+    col = next((c for c in ENTITY_COLUMNS if c in df.columns), None) if use_entity else None
+    return df[col].fillna(ALL_ENTITIES).astype(str) if col else pd.Series(ALL_ENTITIES, index=df.index)
+
+
+def _is_class(name):
+    return str(name).strip().lower() in ACCOUNT_CLASSES
+
+
+def _gl_accounts(gl_txn):
+    """Lower-cased GL account codes and names -> (account, account class)"""
+    if gl_txn is None or 'account' not in gl_txn.columns:
+        return {}
+    lookup = {}
+    accounts = gl_txn.drop_duplicates('account')
+    for name_col in ('account_name', 'account'):
+        if name_col in accounts.columns:
+            for name, account, account_class in zip(accounts[name_col], accounts['account'], accounts['account_class']):
+                lookup[str(name).strip().lower()] = (str(account), str(account_class))
+    return lookup
+
+
+def _budget_account(name, gl_accounts):
+    """(account, account class) of a budget line, which names either an account class or a GL account"""
+    key = str(name).strip().lower()
+    if key in ACCOUNT_CLASSES:
+        return ALL_ACCOUNTS, key
+    return gl_accounts.get(key) or (str(name).strip(), classify_account(account=key))
+
+
+def _budget_lines(budget, use_entity, gl_accounts):
+    budget = ensure_dates(budget.copy(), ['month']).dropna(subset=['month'])
+    if 'account' in budget.columns:
+        accounts = [_budget_account(name, gl_accounts) for name in budget['account']]
+        account, account_class = [a for a, _ in accounts], [c for _, c in accounts]
+    else:
+        account, account_class = ALL_ACCOUNTS, 'revenue'
+    return pd.DataFrame({
+        "month": budget['month'].dt.to_period('M'),
+        "account_class": account_class,
+        "account": account,
+        "entity": _entity(budget, use_entity),
+        "budget": budget['amount'].fillna(0),
+    })
+
+
+def _actual_lines(sales_flat, gl_txn, use_entity, use_account):
+    parts = []
+    has_sales = sales_flat is not None and 'extended_price' in sales_flat.columns
+    if has_sales:
+        date_col = 'order_date' if 'order_date' in sales_flat.columns else 'order_month'
+        sales_flat = ensure_dates(sales_flat.copy(), [date_col]).dropna(subset=[date_col])
+        parts.append(pd.DataFrame({
+            "month": sales_flat[date_col].dt.to_period('M'),
+            "account_class": "revenue",
+            "account": ALL_ACCOUNTS,  # Sales are not posted to a GL account here
+            "entity": _entity(sales_flat, use_entity),
+            "actual": sales_flat['extended_price'].fillna(0),
+        }))
+    if gl_txn is not None and 'date' in gl_txn.columns and 'amount' in gl_txn.columns:
+        gl = gl_txn.dropna(subset=['date'])
+        # Balance-sheet movements are not actuals; revenue may already come from sales_flat
+        actual_classes = EXPENSE_CLASSES if has_sales else PNL_CLASSES
+        gl = gl[gl['account_class'].isin(actual_classes)]
+        account_class = gl['account_class'].astype(str)
+        # Costs are booked as negative amounts in the GL but budgeted as positive
+        sign = np.where(account_class.isin(EXPENSE_CLASSES), -1.0, 1.0)
+        account = gl['account'].astype(str) if use_account and 'account' in gl.columns else ALL_ACCOUNTS
+        parts.append(pd.DataFrame({
+            "month": gl['date'].dt.to_period('M'),
+            "account_class": account_class,
+            "account": account,
+            "entity": _entity(gl, use_entity),
+            "actual": gl['amount'].fillna(0) * sign,
+        }))
+    if not parts:
+        return pd.DataFrame(columns=VARIANCE_KEYS + ["actual"])
+    return pd.concat(parts, ignore_index=True)
+
+
+def _as_shared_categoricals(left, right, keys):
+    """Give both sides identical categorical keys so the merge joins on codes"""
+    for key in keys:
+        categories = pd.Index(left[key].dropna().unique()).union(pd.Index(right[key].dropna().unique()))
+        left[key] = pd.Categorical(left[key], categories=categories)
+        right[key] = pd.Categorical(right[key], categories=categories)
+    return left, right
+
+
+def build_variance_frame(budget, sales_flat, gl_txn):
+    """Budget and actual amounts per month x account x entity"""
+    # Entity and GL account grain are only meaningful when the budget is itself split that way
+    use_entity = budget is not None and any(c in budget.columns for c in ENTITY_COLUMNS)
+    has_budget = budget is not None and 'amount' in budget.columns
+    use_account = has_budget and 'account' in budget.columns and not budget['account'].map(_is_class).all()
+    budget_lines = _budget_lines(budget, use_entity, _gl_accounts(gl_txn)) if has_budget \
+        else pd.DataFrame(columns=VARIANCE_KEYS + ["budget"])
+    actual_lines = _actual_lines(sales_flat, gl_txn, use_entity, use_account)
+
+    budget_cells = budget_lines.groupby(VARIANCE_KEYS, as_index=False)['budget'].sum()
+    actual_cells = actual_lines.groupby(VARIANCE_KEYS, as_index=False)['actual'].sum()
+    budget_cells, actual_cells = _as_shared_categoricals(budget_cells, actual_cells, VARIANCE_KEYS)
+    merged = actual_cells.merge(budget_cells, on=VARIANCE_KEYS, how='outer')
+    merged[['actual', 'budget']] = merged[['actual', 'budget']].fillna(0.0)
+    return merged
+
+
+def load_variance_frame(data_folder):
+    """Joined budget/actual frame, cached per data version"""
+    version = data_version(data_folder, VARIANCE_STEMS)
+
+    def compute():
+        budget, _ = read_table(data_folder, "budget")
+        sales_flat, _ = read_table(data_folder, "sales_flat")
+        return build_variance_frame(budget, sales_flat, load_classified_gl(data_folder))
+
+    return analytics_cache.get_or_compute("variance_frame", version, compute, key=(data_folder,))
+
+
+def rollup(frame, by=("month", "account_class"), classes=None, accounts=None, entities=None,
+           date_start=None, date_end=None):
+    """Actual, budget and variances aggregated to the requested keys"""
+    by = [key for key in VARIANCE_KEYS if key in by]
+    mask = np.ones(len(frame), dtype=bool)
+    if classes:
+        mask &= frame['account_class'].isin(classes).to_numpy()
+    if accounts and (frame['account'] != ALL_ACCOUNTS).any():
+        mask &= frame['account'].isin(accounts).to_numpy()
+    if entities and (frame['entity'] != ALL_ENTITIES).any():
+        # A budget without an entity (or account) split has nothing to filter on
+        mask &= frame['entity'].isin(entities).to_numpy()
+    months = frame['month'].astype('period[M]') if len(frame) else frame['month']
+    if date_start:
+        mask &= (months >= pd.Period(date_start, 'M')).to_numpy()
+    if date_end:
+        mask &= (months <= pd.Period(date_end, 'M')).to_numpy()
+    selected = frame[mask]
+
+    if by:
+        result = selected.groupby(by, observed=True, as_index=False)[['actual', 'budget']].sum()
+    else:
+        result = selected[['actual', 'budget']].sum().to_frame().T
+    result['variance'] = result['actual'] - result['budget']
+    result['variance_pct'] = result['variance'] / result['budget'].abs().replace(0, np.nan) * 100
+    return result
@@ -0,0 +1,230 @@
+"""
+Working-capital time series (DSO, DPO, DIO, CCC) per country x channel.
+
+Month-end open balances come from cumulative sums of invoice and payment
+events, and trailing sales/COGS from a cumulative daily series sampled at
+each month end, so the whole trend is a handful of vectorised passes over
+the data instead of one snapshot calculation per month.
+"""
+from core.lazy import lazy_import
+from core.utils import ensure_dates, CATEGORY_COST_FACTOR
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+DEFAULT_COGS_RATIO = 0.7  # Same assumption as the snapshot metrics
+DIMENSION_COLUMNS = {
+    "country": ["country", "customer_country"],
+    "channel": ["channel_name", "channel"],
+}
+PAYMENT_DATE_COLUMNS = ["paid_date", "payment_date", "last_payment_date"]
+RECEIPT_DATE_COLUMNS = ["receipt_date", "payment_date", "date"]
+INVENTORY_DATE_COLUMNS = ["snapshot_date", "as_of_date", "date"]
+ALL = "All"
+
+
+def _first_column(df, candidates):
+    for col in candidates:
+        if col in df.columns:
+            return col
+    return None
+
+
+def _with_dimensions(df, dims):
+    """Copy of df with each logical dimension as a column (ALL when missing)"""
+    out = pd.DataFrame(index=df.index)
+    for dim in dims:
+        col = _first_column(df, DIMENSION_COLUMNS.get(dim, []))
+        out[dim] = df[col].fillna(ALL).astype(str) if col else ALL
+    return out
+
+
+def _has_dimensions(df, dims):
+    return all(_first_column(df, DIMENSION_COLUMNS.get(dim, [])) for dim in dims)
+
+
+def _month_end_balances(events, dims, month_ends):
+    """Cumulative sum of dated amounts per cell, sampled at each month end"""
+    if events.empty:
+        return pd.DataFrame(columns=month_ends)
+    periods = events['date'].dt.to_period('M')
+    last = month_ends[-1].to_period('M')
+    events = events[periods <= last]
+    periods = periods[periods <= last]
+    if events.empty:
+        return pd.DataFrame(columns=month_ends)
+    monthly = events.groupby(dims + [periods.rename('month')])['amount'].sum().unstack('month', fill_value=0.0)
+    full_range = pd.period_range(min(monthly.columns.min(), month_ends[0].to_period('M')), last, freq='M')
+    balances = monthly.reindex(columns=full_range, fill_value=0.0).cumsum(axis=1)
+    balances = balances[[m.to_period('M') for m in month_ends]]
+    balances.columns = month_ends
+    return balances
+
+
+def _trailing_sums(daily, dims, month_ends, window_days):
+    """Sum over the window_days ending at each month end, via a cumulative daily series"""
+    if daily.empty:
+        return pd.DataFrame(columns=month_ends)
+    start = min(daily['date'].min(), month_ends[0] - pd.Timedelta(days=window_days))
+    day_index = pd.date_range(start.normalize(), month_ends[-1], freq='D')
+    pivot = daily.groupby(dims + [daily['date'].dt.normalize().rename('day')])['amount'].sum()
+    pivot = pivot.unstack('day', fill_value=0.0).reindex(columns=day_index, fill_value=0.0)
+    cumulative = np.concatenate([np.zeros((len(pivot), 1)), pivot.to_numpy().cumsum(axis=1)], axis=1)
+    end_pos = day_index.searchsorted(month_ends, side='right')
+    start_pos = day_index.searchsorted(month_ends - pd.Timedelta(days=window_days), side='right')
+    values = cumulative[:, end_pos] - cumulative[:, start_pos]
+    return pd.DataFrame(values, index=pivot.index, columns=month_ends)
+
+
+def _invoice_events(invoices, dims, receipts=None):
+    """+amount at invoice date and -paid_amount at the best-known payment date"""
+    invoices = ensure_dates(invoices.copy(), ['invoice_date', 'due_date'] + PAYMENT_DATE_COLUMNS)
+    invoices = invoices.dropna(subset=['invoice_date'])
+    keys = _with_dimensions(invoices, dims)
+    raised = keys.assign(date=invoices['invoice_date'], amount=invoices['amount'].fillna(0))
+
+    if 'paid_amount' not in invoices.columns:
+        return raised
+
+    paid_col = _first_column(invoices, PAYMENT_DATE_COLUMNS)
+    receipt_date_col = _first_column(receipts, RECEIPT_DATE_COLUMNS) if receipts is not None else None
+    if paid_col is None and receipt_date_col and 'invoice_id' in receipts.columns and 'invoice_id' in invoices.columns:
+        # Spread receipts back onto invoice dimensions by invoice_id
+        receipts = ensure_dates(receipts.copy(), [receipt_date_col])
+        lookup = keys.assign(invoice_id=invoices['invoice_id']).drop_duplicates('invoice_id')
+        matched = receipts.merge(lookup, on='invoice_id', how='inner')
+        settled = matched[dims].assign(date=matched[receipt_date_col], amount=-matched['amount'].fillna(0))
+    else:
+        # Without payment dates, assume invoices are settled on their due date
+        paid_at = invoices[paid_col] if paid_col else invoices.get('due_date', invoices['invoice_date'])
+        settled = keys.assign(date=paid_at.fillna(invoices['invoice_date']),
+                              amount=-invoices['paid_amount'].fillna(0))
+    return pd.concat([raised, settled.dropna(subset=['date'])], ignore_index=True)
+
+
+def _allocate(total, weights):
+    """Spread a per-month total over cells in proportion to weights"""
+    share = weights / weights.sum(axis=0).replace(0, np.nan)
+    return share.fillna(0.0).mul(total, axis=1)
+
+
+def working_capital_series(ar_invoices, ap_invoices, sales_flat, inventory=None, ar_receipts=None,
+                           months=24, window_days=90, dims=("country", "channel")):
+    """Month-end AR/AP/inventory balances and DSO/DPO/DIO/CCC per dimension cell.
+
+    Returns a dict with the month labels and one frame per measure indexed by
+    the dimension cells (columns are month ends), or None when no sale has a
+    usable order_date to anchor the months on.
+    """
+    dims = list(dims) or ["total"]  # A single all-rows cell when no breakdown is asked for
+    if 'order_date' not in sales_flat.columns:
+        return None
+    sales_flat = ensure_dates(sales_flat.copy(), ['order_date']).dropna(subset=['order_date'])
+    if sales_flat.empty:
+        return None
+    last_date = sales_flat['order_date'].max()
+    month_ends = pd.date_range(end=last_date + pd.offsets.MonthEnd(0), periods=months, freq='ME')
+
+    # Trailing revenue and COGS per cell
+    sales_keys = _with_dimensions(sales_flat, dims)
+    if 'cogs' in sales_flat.columns:
+        cogs_amount = sales_flat['cogs'].fillna(0)
+    elif 'category' in sales_flat.columns:
+        ratio = sales_flat['category'].map(CATEGORY_COST_FACTOR).fillna(DEFAULT_COGS_RATIO)
+        cogs_amount = sales_flat['extended_price'] * ratio
+    else:
+        cogs_amount = sales_flat['extended_price'] * DEFAULT_COGS_RATIO
+    sales = _trailing_sums(sales_keys.assign(date=sales_flat['order_date'], amount=sales_flat['extended_price']),
+                           dims, month_ends, window_days)
+    cogs = _trailing_sums(sales_keys.assign(date=sales_flat['order_date'], amount=cogs_amount),
+                          dims, month_ends, window_days).reindex(sales.index, fill_value=0.0)
+
+    # Month-end open receivables per cell
+    receivables = pd.DataFrame(0.0, index=sales.index, columns=month_ends)
+    if ar_invoices is not None and 'amount' in ar_invoices.columns:
+        ar = _month_end_balances(_invoice_events(ar_invoices, dims, ar_receipts), dims, month_ends)
+        receivables = ar.reindex(sales.index.union(ar.index), fill_value=0.0)
+    cells = receivables.index
+    sales, cogs = sales.reindex(cells, fill_value=0.0), cogs.reindex(cells, fill_value=0.0)
+
+    # Payables and inventory rarely carry customer dimensions; allocate by COGS share then
+    payables = pd.DataFrame(0.0, index=cells, columns=month_ends)
+    if ap_invoices is not None and 'amount' in ap_invoices.columns:
+        events = _invoice_events(ap_invoices, dims if _has_dimensions(ap_invoices, dims) else [])
+        if _has_dimensions(ap_invoices, dims):
+            payables = _month_end_balances(events, dims, month_ends).reindex(cells, fill_value=0.0)
+        else:
+            total = _month_end_balances(events.assign(_all=ALL), ['_all'], month_ends).sum(axis=0)
+            payables = _allocate(total, cogs)
+
+    stock = pd.DataFrame(0.0, index=cells, columns=month_ends)
+    if inventory is not None and {'cost_per_unit', 'quantity_on_hand'} <= set(inventory.columns):
+        value = inventory['cost_per_unit'] * inventory['quantity_on_hand']
+        date_col = _first_column(inventory, INVENTORY_DATE_COLUMNS)
+        if date_col:
+            # Latest snapshot on or before each month end
+            snapshots = value.groupby(pd.to_datetime(inventory[date_col], errors='coerce')).sum().sort_index()
+            pos = snapshots.index.searchsorted(month_ends, side='right') - 1
+            total = pd.Series(np.where(pos >= 0, snapshots.to_numpy()[pos.clip(0)], 0.0), index=month_ends)
+        else:
+            # Only the current position is known; hold it flat across the trend
+            total = pd.Series(float(value.sum()), index=month_ends)
+        stock = _allocate(total, cogs)
+
+    return {
+        "months": [m.strftime('%Y-%m') for m in month_ends],
+        "accountsReceivable": receivables,
+        "accountsPayable": payables,
+        "inventory": stock,
+        "sales": sales,
+        "cogs": cogs,
+    }
+
+
+def ratios(balances, window_days):
+    """DSO/DPO/DIO/CCC frames from summed balances and trailing flows"""
+    daily_sales = balances["sales"] / window_days
+    daily_cogs = balances["cogs"] / window_days
+    dso = balances["accountsReceivable"] / daily_sales.replace(0, np.nan)
+    dpo = balances["accountsPayable"] / daily_cogs.replace(0, np.nan)
+    dio = balances["inventory"] / daily_cogs.replace(0, np.nan)
+    return {"dso": dso, "dpo": dpo, "dio": dio, "ccc": dso + dio - dpo}
+
+
+def series_payload(result, window_days, countries=None, channels=None):
+    """JSON-ready trend for every selected cell plus the selection total"""
+    measures = ["accountsReceivable", "accountsPayable", "inventory", "sales", "cogs"]
+    cells = result["accountsReceivable"].index
+    mask = np.ones(len(cells), dtype=bool)
+    if countries and 'country' in cells.names:
+        mask &= cells.get_level_values('country').isin(countries)
+    if channels and 'channel' in cells.names:
+        mask &= cells.get_level_values('channel').isin(channels)
+    selected = {name: result[name][mask] for name in measures}
+
+    def rounded(values, decimals=1):
+        return [None if pd.isna(v) else round(float(v), decimals) for v in values]
+
+    series = []
+    cell_ratios = ratios(selected, window_days)
+    for i, cell in enumerate(selected["accountsReceivable"].index):
+        labels = cell if isinstance(cell, tuple) else (cell,)
+        item = dict(zip(cells.names, labels))
+        for name, frame in cell_ratios.items():
+            item[name] = rounded(frame.iloc[i])
+        for name in measures[:3]:
+            item[name] = rounded(selected[name].iloc[i], 0)
+        series.append(item)
+
+    totals = {name: frame.sum(axis=0).to_frame().T for name, frame in selected.items()}
+    total_ratios = ratios(totals, window_days)
+    total = {name: rounded(frame.iloc[0]) for name, frame in total_ratios.items()}
+    total.update({name: rounded(totals[name].iloc[0], 0) for name in measures[:3]})
+
+    return {
+        "months": result["months"],
+        "window_days": window_days,
+        "dimensions": list(cells.names),
+        "series": series,
+        "total": total,
+    }